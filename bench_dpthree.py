@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+"""Benchmarks for dpthree.
+
+Run all benchmarks with:
+    python bench_dpthree.py
+
+Or only some of them, by name:
+    python bench_dpthree.py production
+
+Use --json to also write the results to a file, to compare between releases,
+and --large to also run the bulk benchmarks with 100 MB payloads.
+These also run as the highest level of run_tests.py.
+"""
+
+# NOTE: in case we use Python 2
+from __future__ import (print_function,
+                        absolute_import,
+                        division)
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import tempfile
+import warnings
+import subprocess
+
+import dpthree
+
+BENCHMARKS = []
+
+# Payload sizes for the bulk benchmarks. --large adds 100 MB.
+SIZES = [('1 KB', 1 << 10), ('1 MB', 1 << 20)]
+LARGE_SIZES = [('100 MB', 100 << 20)]
+
+
+def benchmark(func):
+    """Register a benchmark function.
+
+    Benchmark functions take no arguments and return a list of
+    (label, value) pairs, where the value is in seconds, or of
+    (label, value, unit) triples for anything else.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def per_call(stmt, setup='pass', number=100000, repeat=5):
+    """Return the best time, in seconds, taken by a single run of stmt."""
+    timer = timeit.Timer(stmt, setup)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+@benchmark
+def production():
+    """Per call cost of removed/kludges names in each mode versus native."""
+    calls = [('reduce', 'removed.reduce(add, seq)',
+              'functools.reduce(add, seq)'),
+             ('unichr', 'removed.unichr(65)', 'builtins.chr(65)'),
+             ('xrange', 'removed.xrange(10)', 'builtins.range(10)'),
+             ('unicode', 'removed.unicode()', 'builtins.str()'),
+             ('bytechr', 'kludges.bytechr(65)', 'bytechr(65)')]
+    setup = ('import functools\n'
+             'from operator import add\n'
+             'from dpthree import builtins, removed, kludges, bytechr\n'
+             'seq = [1, 2, 3]')
+
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        previous = dpthree._production
+        try:
+            for name, stmt, native in calls:
+                dpthree.configure(production=False)
+                results.append((name + ' (wrapped)', per_call(stmt, setup)))
+                dpthree.configure(production=True)
+                results.append((name + ' (production)', per_call(stmt, setup)))
+                results.append((name + ' (native)', per_call(native, setup)))
+        finally:
+            dpthree.configure(production=previous)
+
+    return results
+
+
+@benchmark
+def sampling():
+    """Per call cost of a removed name with and without sampling."""
+    setup = 'from dpthree import removed'
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        results.append(('unichr (every call)', per_call('removed.unichr(65)', setup)))
+        try:
+            dpthree.set_sampling('unichr', every=1000)
+            results.append(('unichr (1 in 1000)', per_call('removed.unichr(65)', setup)))
+            dpthree.set_sampling('unichr', rate=10)
+            results.append(('unichr (10 per second)', per_call('removed.unichr(65)', setup)))
+        finally:
+            dpthree.set_sampling('unichr')
+            dpthree.samples(clear=True)
+
+    return results
+
+
+# NOTE: run in a fresh interpreter from the directory of the dpthree to
+# import, given as the first argument, and prints a JSON list of
+# (phase, seconds, added sys.modules entries, added gc tracked objects).
+_IMPORT_PHASES = r"""
+import gc, os, sys, time, json, importlib
+clock = getattr(time, 'perf_counter', time.time)
+
+def snapshot():
+    return clock(), len(sys.modules), len(gc.get_objects())
+
+phases = []
+def phase(name, start):
+    end = snapshot()
+    phases.append((name,) + tuple(e - s for e, s in zip(end, start)))
+    return snapshot()
+
+start = snapshot()
+import dpthree
+start = phase('import dpthree', start)
+
+if os.path.dirname(os.path.realpath(dpthree.__file__)) != sys.argv[1]:
+    sys.exit('imported the wrong dpthree: %s' % dpthree.__file__)
+
+if dpthree.PY2:
+    for name in dpthree.builtins.__all__:
+        getattr(dpthree.builtins, name)
+start = phase('builtins', start)
+
+for mod in (dpthree.removed, dpthree.kludges):
+    for name in mod.__all__:
+        getattr(mod, name)
+start = phase('removed/kludges', start)
+
+for name in sorted(dpthree._name_map):
+    if name != 'tkinter':
+        try:
+            importlib.import_module('dpthree.modules.' + name)
+        except ImportError:
+            pass
+start = phase('renamed modules', start)
+
+try:
+    importlib.import_module('dpthree.modules.tkinter')
+    for name in sorted(dpthree._tk_map):
+        importlib.import_module('dpthree.modules.tkinter.' + name)
+except ImportError:
+    pass
+start = phase('tkinter aliases', start)
+
+print(json.dumps(phases))
+"""
+
+
+def import_phases(path, flags=(), env=None, repeat=5):
+    """Run the import phases in fresh interpreters and return the best run."""
+    path = os.path.realpath(path)
+    best = {}
+    for _ in range(repeat):
+        # NOTE: with -c, sys.path[0] is the working directory
+        output = subprocess.check_output(
+            [sys.executable] + list(flags) + ['-c', _IMPORT_PHASES, path],
+            cwd=path, env=env)
+        for name, seconds, modules, objects in json.loads(output.decode()):
+            if name not in best or seconds < best[name][0]:
+                best[name] = (seconds, modules, objects)
+
+    return best
+
+
+@benchmark
+def import_time():
+    """Cost of `import dpthree` and of building each part of it on first use."""
+    names = ['import dpthree', 'builtins', 'removed/kludges',
+             'renamed modules', 'tkinter aliases']
+    results = []
+
+    # NOTE: import a copy of dpthree, so that the cold runs really do start
+    # without any bytecode cache
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shutil.copy(dpthree.__file__.replace('.pyc', '.py'), tmpdir)
+        env = dict(os.environ)
+        env.pop('PYTHONPATH', None)
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        cold = import_phases(tmpdir, ['-B'], env)
+        import_phases(tmpdir, [], env, repeat=1)  # write the bytecode cache
+        warm = import_phases(tmpdir, [], env)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for kind, phases in (('cold', cold), ('warm', warm)):
+        for name in names:
+            seconds, modules, objects = phases[name]
+            label = '%s: %s' % (kind, name)
+            results.append((label, seconds))
+            results.append((label, modules, 'modules'))
+            results.append((label, objects, 'objects'))
+
+    return results
+
+
+def sized_per_call(stmt, setup, size):
+    """Like per_call, but runs big payloads fewer times."""
+    number = max(1, min(100000, (1 << 20) // size * 10))
+    return per_call(stmt, setup, number=number, repeat=3)
+
+
+@benchmark
+def bytes_construction():
+    """Building builtins.bytes from int iterables and buffers."""
+    sources = [('list', 'list(bytearray(size))'),
+               ('bytearray', 'bytearray(size)'),
+               ('memoryview', 'memoryview(bytearray(size))'),
+               ('array', "array.array('B', bytearray(size))")]
+    results = []
+    for size_label, size in SIZES:
+        for name, source in sources:
+            setup = ('import array\n'
+                     'from dpthree import builtins\n'
+                     'size = %d\n'
+                     'source = %s' % (size, source))
+            label = '%s from %s' % (size_label, name)
+            results.append((label, sized_per_call('builtins.bytes(source)',
+                                                  setup, size)))
+            if dpthree.PY2 and name == 'list':
+                # NOTE: how builtins.bytes used to do it
+                results.append((label + ' (per byte)', sized_per_call(
+                    "b''.join(map(chr, source))", setup, size)))
+
+    return results
+
+
+@benchmark
+def bytes_iteration():
+    """Iterating over the ints in builtins.bytes."""
+    results = []
+    for size_label, size in SIZES:
+        setup = ('from dpthree import builtins\n'
+                 'data = builtins.bytes(bytearray(range(256)) * (%d // 256))\n'
+                 'native = bytearray(data)' % size)
+        results.append((size_label, sized_per_call('for i in data: pass',
+                                                   setup, size)))
+        results.append((size_label + ' (bytearray)', sized_per_call(
+            'for i in native: pass', setup, size)))
+        if dpthree.PY2:
+            # NOTE: how Python 3 style code had to do it before
+            results.append((size_label + ' (indexing)', sized_per_call(
+                'for i in range(len(data)): data[i]', setup, size)))
+
+    return results
+
+
+@benchmark
+def int_bytes():
+    """Converting between builtins.int, builtins.bytes and hex strings."""
+    calls = [('to_bytes', "value.to_bytes(size, 'big')"),
+             ('from_bytes', "builtins.int.from_bytes(data, 'big')"),
+             ('hex', 'data.hex()'),
+             ('fromhex', 'builtins.bytes.fromhex(text)')]
+    results = []
+    for size_label, size in [('8 B', 8)] + SIZES:
+        setup = ('import os\n'
+                 'from dpthree import builtins\n'
+                 'size = %d\n'
+                 'data = builtins.bytes(os.urandom(size))\n'
+                 "value = builtins.int.from_bytes(data, 'big')\n"
+                 'text = data.hex()' % size)
+        for name, stmt in calls:
+            results.append(('%s %s' % (size_label, name),
+                            sized_per_call(stmt, setup, size)))
+
+    return results
+
+
+# NOTE: an ABCMeta based class, as removed.basestring and the Python 2
+# builtins.int and builtins.bytes used to be, that stands in for subs
+_ABC_TYPE = '''
+import abc
+class old_type(object):
+    __metaclass__ = abc.ABCMeta
+    @classmethod
+    def __subclasshook__(cls, C):
+        return issubclass(C, subs)
+if not isinstance(old_type, abc.ABCMeta):  # Python 3
+    old_type = abc.ABCMeta('old_type', (object,), dict(vars(old_type)))
+'''
+
+
+@benchmark
+def isinstance_checks():
+    """isinstance against dpthree's stand in types, ABCs and native types."""
+    setup = ('from dpthree import removed, PY2\n'
+             'subs = (basestring,) if PY2 else (str, bytes)\n' +
+             _ABC_TYPE +
+             "value = u'unicode string'\n"
+             'classes = [type(str(i), (object,), {})() for i in range(1000)]')
+    results = []
+    # NOTE: recorded, so that the warnings under the default filters aren't
+    # printed
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter('default', DeprecationWarning)
+        results.append(('basestring (wrapped, default filters)', per_call(
+            'isinstance(value, removed.basestring)', setup)))
+
+        warnings.simplefilter('ignore', DeprecationWarning)
+        previous = dpthree._production
+        try:
+            for mode in ('wrapped', 'production'):
+                dpthree.configure(production=mode == 'production')
+                results.append(('basestring (%s)' % mode, per_call(
+                    'isinstance(value, removed.basestring)', setup)))
+                results.append(('1000 new classes (%s)' % mode, per_call(
+                    'for c in classes: isinstance(c, removed.basestring)',
+                    setup, number=1, repeat=20)))
+        finally:
+            dpthree.configure(production=previous)
+
+    results.append(('basestring (ABC)', per_call(
+        'isinstance(value, old_type)', setup)))
+    # NOTE: every new class checked adds to the ABC caches
+    results.append(('1000 new classes (ABC)', per_call(
+        'for c in classes: isinstance(c, old_type)', setup,
+        number=1, repeat=20)))
+    results.append(('basestring (native)', per_call(
+        'isinstance(value, subs)', setup)))
+
+    if dpthree.PY2:
+        for name, subs, value in (('int', '(int, long)', '5'),
+                                  ('bytes', '(str,)', "b'bytes'")):
+            setup = ('from dpthree import builtins\n'
+                     'subs = %s\n' % subs + _ABC_TYPE +
+                     'value = %s' % value)
+            results.append(('%s (builtins)' % name, per_call(
+                'isinstance(value, builtins.%s)' % name, setup)))
+            results.append(('%s (ABC)' % name, per_call(
+                'isinstance(value, old_type)', setup)))
+            results.append(('%s (native)' % name, per_call(
+                'isinstance(value, subs)', setup)))
+
+    return results
+
+
+@benchmark
+def ranges():
+    """Iterating over and testing membership in builtins.range."""
+    setup = ('from dpthree import builtins, PY2\n'
+             'native = xrange if PY2 else range\n'
+             'big = builtins.range(0, 10 ** 12, 3)\n'
+             'million = 3 * 10 ** 6 - 3  # the last one in small')
+    results = [('iterate 1M', per_call('for i in builtins.range(10 ** 6): pass',
+                                       setup, number=10)),
+               ('iterate 1M (native)', per_call(
+                   'for i in native(10 ** 6): pass', setup, number=10)),
+               ('contains (range of 3e11)', per_call('million in big',
+                                                     setup)),
+               ('slice', per_call('big[10:-10:2]', setup))]
+    if dpthree.PY2:
+        # NOTE: xrange can't hold 1e12 numbers, and searches one by one
+        results.append(('contains (xrange of 1e6)', per_call(
+            'million in small', setup + '\nsmall = xrange(0, 3 * 10 ** 6, 3)',
+            number=10)))
+
+    return results
+
+
+@benchmark
+def int_construction():
+    """Building builtins.int and doing arithmetic with it."""
+    setup = ('from dpthree import builtins\n'
+             'x = builtins.int(12345)\n'
+             'native = 12345')
+    modes = [('', False)]
+    if dpthree.PY2:
+        modes.append((' (small ints)', True))
+
+    results = []
+    try:
+        for suffix, small_ints in modes:
+            dpthree.configure(small_ints=small_ints)
+            for label, stmt in (('int(5)', 'builtins.int(5)'),
+                                ('int(5.5)', 'builtins.int(5.5)'),
+                                ("int('5')", "builtins.int('5')"),
+                                ('arithmetic', 'x * x + x // 7')):
+                results.append((label + suffix, per_call(stmt, setup)))
+    finally:
+        dpthree.configure(small_ints=False)
+
+    results.append(('int(5) (native)', per_call('int(5)', setup)))
+    results.append(('arithmetic (native)', per_call(
+        'native * native + native // 7', setup)))
+    return results
+
+
+@benchmark
+def decimal_strings():
+    """Converting big ints to and from decimal strings, against native."""
+    setup = ('from dpthree import int2str, str2int\n'
+             "text = '7' * %d\n"
+             'value = str2int(text)')
+    results = []
+    limit = getattr(sys, 'get_int_max_str_digits', lambda: None)()
+    if limit is not None:
+        sys.set_int_max_str_digits(0)
+    try:
+        for label, digits in (('1K', 1000), ('10K', 10000), ('100K', 100000),
+                              ('1M', 1000000)):
+            # NOTE: the native conversions of 1M digits take many seconds
+            number, repeat = (1, 1) if digits >= 100000 else (100, 3)
+            for name, stmt in (('str2int', 'str2int(text)'),
+                               ('int (native)', 'int(text)'),
+                               ('int2str', 'int2str(value)'),
+                               ('str (native)', 'str(value)')):
+                results.append(('%s digits %s' % (label, name), per_call(
+                    stmt, setup % digits, number=number, repeat=repeat)))
+    finally:
+        if limit is not None:
+            sys.set_int_max_str_digits(limit)
+
+    return results
+
+
+@benchmark
+def bytechr():
+    """Building byte strings from ordinals with bytechr and bytechrs."""
+    setup = ('from dpthree import bytechr, bytechrs\n'
+             'data = list(range(256)) * 4')
+    results = [('bytechr', per_call('bytechr(200)', setup))]
+    if dpthree.PY3:
+        # NOTE: how bytechr used to do it, where Python 2 just uses chr
+        results.append(('bytechr (per call)', per_call(
+            "chr(200).encode('latin1')", setup)))
+
+    results.append(('1 KB bytechrs', per_call('bytechrs(data)', setup,
+                                              number=10000)))
+    results.append(('1 KB joined bytechr', per_call(
+        "b''.join(map(bytechr, data))", setup, number=10000)))
+    return results
+
+
+@benchmark
+def bytestr():
+    """Iterating over kludges.bytestr, one byte strings at a time."""
+    results = []
+    for size_label, size in SIZES:
+        setup = ('from dpthree import kludges, bytestr\n'
+                 'data = bytestr(bytearray(range(256)) * (%d // 256))\n'
+                 'native = bytearray(data)' % size)
+        results.append((size_label, sized_per_call('for c in data: pass',
+                                                   setup, size)))
+        # NOTE: how ported code had to do it before, which is far slower
+        results.append((size_label + ' (bytechr per byte)', per_call(
+            'for i in range(len(native)): kludges.bytechr(native[i])',
+            setup, number=1, repeat=3)))
+
+    return results
+
+
+@benchmark
+def compile_cache():
+    """Compiling the same template sources over and over, cached and not."""
+    setup = ('from dpthree import builtins\n'
+             'from dpthree import _native_compile as native\n'
+             "source = '\\n'.join('x%d = y * %d + z' % (i, i) "
+             "for i in range(100))\n"
+             "view = memoryview(source.encode('ascii'))")
+    results = []
+    try:
+        dpthree.configure(compile_cache=128)
+        results.append(('100 lines (cached)', per_call(
+            "builtins.compile(source, '<t>', 'exec')", setup)))
+        results.append(('100 lines memoryview (cached)', per_call(
+            "builtins.compile(view, '<t>', 'exec')", setup)))
+        dpthree.configure(compile_cache=0)
+        results.append(('100 lines (uncached)', per_call(
+            "builtins.compile(source, '<t>', 'exec')", setup, number=1000)))
+    finally:
+        dpthree.configure(compile_cache=128 if dpthree.PY2 else 0)
+
+    results.append(('100 lines (native)', per_call(
+        "native(source, '<t>', 'exec')", setup, number=1000)))
+    return results
+
+
+@benchmark
+def execfile():
+    """Executing 1,000 unchanged scripts again, cached and not."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for n in range(1000):
+            paths.append(os.path.join(tmpdir, 'script%d.py' % n))
+            with open(paths[-1], 'w') as script:
+                script.write(''.join('option%d = %d * %d\n' % (i, i, n)
+                                     for i in range(20)))
+
+        setup = ('import io\n'
+                 'from dpthree import removed\n'
+                 'paths = %r' % (paths,))
+        # NOTE: how a loader has to do it without execfile
+        uncached = ('for path in paths:\n'
+                    "    with io.open(path, 'rb') as script:\n"
+                    "        exec(compile(script.read(), path, 'exec'), {})")
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            results = [('1000 scripts', per_call(
+                'for path in paths: removed.execfile(path, {})', setup,
+                number=10)),
+                ('1000 scripts (read and compile)', per_call(
+                    uncached, setup, number=10))]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return results
+
+
+@benchmark
+def buffer():
+    """Taking removed.buffer views of payloads, against copying slices."""
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        for size_label, size in SIZES:
+            setup = ('from dpthree import removed\n'
+                     'data = bytearray(%d)\n'
+                     'view = removed.buffer(data)' % size)
+            results.append((size_label + ' buffer(data, 16, size)', per_call(
+                'removed.buffer(data, 16, %d)' % (size - 32), setup)))
+            # NOTE: Python 2 buffers copy when sliced
+            results.append((size_label + ' slice of buffer', sized_per_call(
+                'view[16:-16]', setup, size if dpthree.PY2 else 1)))
+            # NOTE: what ported code does instead, which copies
+            results.append((size_label + ' slice of data (copy)',
+                            sized_per_call('data[16:-16]', setup, size)))
+
+    return results
+
+
+# cmp functions for the sorted_cmp benchmark, here since it reads their source
+_cmp = dpthree._cmp
+_cmp_by_x = lambda a, b: _cmp(a.x, b.x)
+_cmp_by_xy = lambda a, b: _cmp(a.x, b.x) or _cmp(a.y, b.y)
+_cmp_other = lambda a, b: (a.x > b.x) - (a.x < b.x)
+
+
+@benchmark
+def sorted_cmp():
+    """Sorting records with cmp functions, against functools.cmp_to_key."""
+    setup = ('import random, functools, collections\n'
+             'from dpthree import kludges\n'
+             'from bench_dpthree import _cmp_by_x, _cmp_by_xy, _cmp_other\n'
+             "Record = collections.namedtuple('Record', 'x y')\n"
+             'records = [Record(random.random(), random.random())\n'
+             '           for _ in range(%d)]')
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        for label, count in (('10K', 10000), ('100K', 100000)):
+            number = 10 if count < 100000 else 1
+            for name, cmp in (('by x', '_cmp_by_x'),
+                              ('by x then y', '_cmp_by_xy'),
+                              ('other', '_cmp_other')):
+                results.append(('%s %s' % (label, name), per_call(
+                    'kludges.sorted_cmp(records, %s)' % cmp, setup % count,
+                    number=number, repeat=3)))
+                results.append(('%s %s (cmp_to_key)' % (label, name),
+                                per_call('sorted(records, key=functools.'
+                                         'cmp_to_key(%s))' % cmp,
+                                         setup % count, number=number,
+                                         repeat=3)))
+
+    return results
+
+
+def format_value(value, unit='s'):
+    """Format a benchmark result for humans."""
+    if unit != 's':
+        return '%12d %s' % (value, unit)
+    elif value < 1e-6:
+        return '%12.1f ns' % (value * 1e9)
+    elif value < 1e-3:
+        return '%12.1f us' % (value * 1e6)
+    return '%12.1f ms' % (value * 1e3)
+
+
+def parse_args(args=sys.argv):
+    parser = argparse.ArgumentParser(description='Run dpthree benchmarks')
+    parser.add_argument('names', nargs='*', help='Names of the benchmarks to '
+                        'run. Defaults to running all of them.')
+    parser.add_argument('--json', metavar='PATH', help='Also write the '
+                        'results to this file as JSON.')
+    parser.add_argument('--large', action='store_true', help='Also run the '
+                        'bulk benchmarks with 100 MB payloads.')
+
+    return parser.parse_args(args[1:])
+
+
+def main(args=sys.argv):
+    pargs = parse_args(args)
+    if pargs.large:
+        SIZES.extend(LARGE_SIZES)
+
+    report = dict(python=sys.version, benchmarks={})
+    for func in BENCHMARKS:
+        if pargs.names and func.__name__ not in pargs.names:
+            continue
+
+        print('%s: %s' % (func.__name__, func.__doc__))
+        rows = report['benchmarks'][func.__name__] = []
+        for result in func():
+            label, value, unit = result if len(result) == 3 else result + ('s',)
+            print('    %-40s %s' % (label, format_value(value, unit)))
+            rows.append(dict(label=label, value=value, unit=unit))
+
+    if pargs.json:
+        with open(pargs.json, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    retval = main(sys.argv)
+    sys.exit(retval)
@@ -28,6 +28,10 @@ reduce has been moved to the functools module in Python 3
 
 basestring has been removed in Python 3 as str and bytes do not share a common
 parent. Use isinstance(obj, (str, bytes)) instead.
+
+Setting the DPTHREE_PRODUCTION environment variable before import (or calling
+dpthree.configure(production=True)) binds the removed names straight to their
+replacements instead, so they never warn and cost nothing extra to call.
 """
 from __future__ import print_function, absolute_import, division
 
@@ -35,18 +39,325 @@ __all__ = ('builtins', 'removed', 'kludges')
 # __all__ = ('builtins', 'tkinter', 'dbm', 'winreg')
 
 import io
+import os
+import re
 import sys
-import abc
+import gc
+import time
 import types
+import operator
 import warnings
+import weakref
+import __future__
+import traceback
+import importlib
+import threading
 import functools
+import contextlib
+import collections
+from _ast import PyCF_ONLY_AST as _PyCF_ONLY_AST
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+try:
+    from importlib.util import spec_from_loader
+except ImportError:  # Python 2
+    spec_from_loader = None
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 
+# In production mode the names in `removed` and `kludges` are bound straight to
+# the callables they stand in for, without any deprecation warnings.
+_production = os.environ.get('DPTHREE_PRODUCTION', '') not in ('', '0')
+
+
+# Call sites (code object id, instruction offset and removed name) that have
+# used a removed name, mapped to [code object, line, filters, first filter]:
+# the line is (removed name, filename, line number), and the filters are the
+# state of the warning filters when the site last went through
+# `warnings.warn`, or None. Holding the code object keeps its id from being
+# reused by another call site. Every eval or exec of source makes new code
+# objects, so the table is emptied whenever it gets too big.
+_sites = {}
+_max_sites = 4096
+
+# Usage counters, one table per thread so that counting never takes a lock,
+# by a weak reference to an object that lives as long as the thread. When a
+# thread ends, that reference goes to `_stats_ended`, and its table is later
+# folded into `_stats_totals`.
+_stats_tables = {}
+_stats_ended = []
+_stats_totals = {}
+_stats_lock = threading.Lock()
+
+UsageStat = collections.namedtuple('UsageStat', 'name filename lineno count')
+
+
+class _StatsOwner(object):
+    """Stands for a thread in `_stats_tables`."""
+
+    __slots__ = ('__weakref__',)
+
+
+class _ThreadStats(threading.local):
+    """The usage counters of the current thread, and whether it is quiet."""
+
+    def __init__(self):
+        self.counts = {}
+        self.quiet = False
+        self.owner = _StatsOwner()
+        with _stats_lock:
+            _fold_ended_stats()
+            # NOTE: the callback only queues the table, since it can run in
+            # the middle of anything, including `stats` holding the lock
+            _stats_tables[weakref.ref(self.owner,
+                                      _stats_ended.append)] = self.counts
+
+
+def _fold_ended_stats():
+    """Add the counters of ended threads to the totals; needs _stats_lock."""
+    while _stats_ended:
+        for line, count in _stats_tables.pop(_stats_ended.pop()).items():
+            _stats_totals[line] = _stats_totals.get(line, 0) + count
+
+
+_stats_local = _ThreadStats()
+
+
+def stats(reset=False):
+    """Return how often each removed name was used, and from where.
+
+    The result is a snapshot: a list of UsageStat tuples of (name, filename,
+    lineno, count), one per line, sorted by descending count. If reset is
+    true, the counters are also set back to zero, and the call sites seen so
+    far are forgotten.
+    """
+    with _stats_lock:
+        _fold_ended_stats()
+        totals = _stats_totals.copy()
+        for table in _stats_tables.values():
+            for line, count in table.copy().items():
+                totals[line] = totals.get(line, 0) + count
+            if reset:
+                table.clear()
+        if reset:
+            _stats_totals.clear()
+            _sites.clear()
+
+    result = [UsageStat(*(line + (count,))) for line, count in totals.items()]
+    result.sort(key=lambda stat: (-stat.count, stat.name, stat.filename,
+                                  stat.lineno))
+    return result
+
+
+# Sampling policies by removed name, and the most recent sampled uses.
+_samplers = {}
+_samples = collections.deque(maxlen=1000)
+
+Sample = collections.namedtuple('Sample', 'name time stack')
+
+_clock = getattr(time, 'monotonic', time.time)
+_getframe = sys._getframe
+
+
+class _EverySampler(object):
+    """Sample the first and then every nth call."""
+
+    def __init__(self, every):
+        self.every = every
+        self.countdown = 1
+
+    def __call__(self):
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.every
+        return True
+
+
+class _RateSampler(object):
+    """Sample at most rate calls per second, in bursts of up to burst calls."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = _clock()
+
+    def __call__(self):
+        now = _clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def set_sampling(name, every=None, rate=None, burst=1):
+    """Only record some of the uses of a removed name.
+
+    With every, only one in every that many calls is recorded. With rate, at
+    most that many calls per second are recorded (allowing bursts of up to
+    burst calls). With neither, every call is recorded again.
+
+    Only recorded calls are counted, warned about and have their stack saved
+    for `samples`; the others return straight away.
+    """
+    if every is not None and rate is not None:
+        raise TypeError('set_sampling() takes either every or rate, not both')
+    elif every is not None:
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        _samplers[name] = _EverySampler(every)
+    elif rate is not None:
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be positive and burst at least 1')
+        _samplers[name] = _RateSampler(rate, burst)
+    else:
+        _samplers.pop(name, None)
+
+
+def samples(clear=False):
+    """Return the most recent sampled uses of removed names.
+
+    The result is a list of Sample tuples of (name, time, stack), oldest
+    first, where stack is a list of (filename, lineno, function, line) entries
+    as from `traceback.extract_stack`. Only names with a sampling policy (see
+    `set_sampling`) are recorded. If clear is true, they are also forgotten.
+    """
+    result = list(_samples)
+    if clear:
+        _samples.clear()
+    return result
+
+
+# Whether warnings about removed names are suppressed, per task where there
+# are contextvars, and otherwise per thread, in `_ThreadStats.quiet`.
+if contextvars is not None:
+    _quiet = contextvars.ContextVar('dpthree_quiet', default=False)
+    _is_quiet = _quiet.get
+    _set_quiet = _quiet.set
+    _reset_quiet = _quiet.reset
+else:
+    _quiet = None
+
+    def _is_quiet():
+        return _stats_local.quiet
+
+    def _set_quiet(value):
+        previous = _stats_local.quiet
+        _stats_local.quiet = value
+        return previous
+
+    def _reset_quiet(previous):
+        _stats_local.quiet = previous
+
+
+@contextlib.contextmanager
+def quiet():
+    """Suppress warnings about removed names within a block of code.
+
+    Unlike `warnings.catch_warnings`, this leaves the global warning filters
+    alone and only affects the current thread (or asyncio task, where
+    contextvars are available). Uses of removed names are still counted.
+    """
+    token = _set_quiet(True)
+    try:
+        yield
+    finally:
+        _reset_quiet(token)
+
+
+def _filter_matches(pattern, text):
+    """Match text against a message or module pattern from a warning filter."""
+    if pattern is None:
+        return True
+    elif isinstance(pattern, str):
+        return pattern == text
+    return pattern.match(text) is not None
+
+
+def _filter_action(message, category, module, lineno):
+    """Return the action the warning filters would take for a warning."""
+    for action, msg, cat, mod, ln in warnings.filters:
+        if (_filter_matches(msg, message) and issubclass(category, cat) and
+                _filter_matches(mod, module) and (ln == 0 or lineno == ln)):
+            return action
+    return warnings.defaultaction
+
+
+def _warn(name, message, category, stacklevel=2):
+    """Count a use of a removed name and warn about it.
+
+    Once a call site has been through `warnings.warn`, later calls from it
+    return straight away instead of walking the stack and looking up the
+    warning registry again. Call sites are checked again whenever the warning
+    filters change, and never skipped while the filters say "always".
+    """
+    sampler = _samplers.get(name) if _samplers else None
+    if sampler is not None and not sampler():
+        return
+
+    try:
+        frame = _getframe(stacklevel)
+    except ValueError:
+        warnings.warn(message, category, stacklevel=stacklevel + 1)
+        return
+
+    if sampler is not None:
+        _samples.append(Sample(name, time.time(),
+                               traceback.extract_stack(frame)))
+
+    # NOTE: code objects are keyed by id, since hashing them is not cheap, and
+    # the instruction offset is used as the line number can take longer to
+    # look up than all the rest.
+    code = frame.f_code
+    site = id(code), frame.f_lasti, name
+    entry = _sites.get(site)
+    if entry is None:
+        if len(_sites) >= _max_sites:
+            _sites.clear()
+        entry = _sites[site] = [code, (name, code.co_filename, frame.f_lineno),
+                                None, None]
+
+    state = _stats_local
+    counts = state.counts
+    line = entry[1]
+    try:
+        counts[line] += 1
+    except KeyError:
+        counts[line] = 1
+
+    # NOTE: `_is_quiet`, inlined
+    if state.quiet if _quiet is None else _quiet.get():
+        return
+
+    # NOTE: the filters are compared by identity, since `catch_warnings` swaps
+    # in a new list and `simplefilter` inserts a new first entry.
+    filters = warnings.filters
+    first = filters[0] if filters else None
+    if entry[2] is filters and entry[3] is first:
+        return
+
+    # NOTE: an "error" action raises here, so such call sites never get cached
+    warnings.warn(message, category, stacklevel=stacklevel + 1)
+
+    module = frame.f_globals.get('__name__', '<string>')
+    if _filter_action(message, category, module, frame.f_lineno) != 'always':
+        entry[2:] = filters, first
+
 
 def _func_warn(f, name=None, msg=None, cat=DeprecationWarning):
     """Wrap callables with a deprecation warning."""
+    if _production:
+        return f
+
     name = name if name is not None else f.__name__
     wrnmsg = ('The builtin callable "{name}" is removed in Python 3 and '
               'should no longer be used.'.format(name=name))
@@ -55,9 +366,11 @@ def _func_warn(f, name=None, msg=None, cat=DeprecationWarning):
 
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        warnings.warn(wrnmsg, cat, stacklevel=2)
+        _warn(name, wrnmsg, cat)
         return f(*args, **kwargs)
     wrapper.__name__ = name
+    # NOTE: functools.wraps only sets this on Python 3
+    wrapper.__wrapped__ = f
 
     # NOTE: this may cause issues. Consider removal.
     wrapper.__doc__ = f.__doc__.replace(f.__name__, name)
@@ -67,6 +380,9 @@ def _func_warn(f, name=None, msg=None, cat=DeprecationWarning):
 
 def _class_warn(return_type, subs=None, name=None, msg=None,
                 cat=DeprecationWarning):
+    if _production and subs is None:
+        return return_type
+
     subs = (return_type,) if subs is None else subs
 
     name = name if name is not None else return_type.__name__
@@ -76,20 +392,335 @@ def _class_warn(return_type, subs=None, name=None, msg=None,
     wrnmsg = wrnmsg if msg is None else msg
     wrnmsg = wrnmsg.format(name=name)
 
+    # NOTE: in production mode, only types that can't be returned as is (i.e.,
+    # basestring) get here.
+    warn = not _production
+
     def __new__(cls, *args, **kwargs):
         """Use as factory function for real underlying type."""
-        warnings.warn(wrnmsg, cat, stacklevel=2)
+        if warn:
+            _warn(name, wrnmsg, cat)
         return return_type(*args, **kwargs)
 
-    @classmethod
-    def __subclasshook__(cls, C):
-        """Check inheritance against real underlying type(s)."""
-        warnings.warn(wrnmsg, cat, stacklevel=4)
-        return issubclass(C, subs)
+    attrs = dict(__new__=__new__, _subs=subs,
+                 _warning=(name, wrnmsg, cat) if warn else None)
+
+    return _BridgeMeta(name, (object,), attrs)
+
+
+class _BridgeMeta(type):
+    """Metaclass for classes that stand in for other types.
+
+    Instances and subclasses of the types in the `_subs` attribute of such a
+    class count as its own. Unlike abc.ABCMeta, this caches nothing, so
+    checking any number of classes uses no extra memory, and each check is a
+    plain tuple check. If the class has a `_warning` of (name, message,
+    category), checks are counted and warned about like calls of removed
+    names. Once their call site has warned, checks from it only bump the
+    counter of `stats`, unless the name is being sampled.
+    """
+
+    _subs = None
+    _warning = None
+
+    def __init__(cls, name, bases, namespace):
+        super(_BridgeMeta, cls).__init__(name, bases, namespace)
+        # NOTE: subclasses only count their real subclasses and instances
+        if '_subs' not in namespace:
+            cls._subs = cls._warning = None
+
+    # NOTE: the site checks are inlined, as they cost more than the rest
+    def __instancecheck__(cls, instance):
+        warning = cls._warning
+        if warning is not None:
+            frame = _getframe(1)
+            entry = _sites.get((id(frame.f_code), frame.f_lasti, warning[0]))
+            filters = warnings.filters
+            if (entry is None or entry[2] is not filters or
+                    entry[3] is not (filters[0] if filters else None) or
+                    _samplers and warning[0] in _samplers):
+                _warn(*warning)
+            else:
+                counts = _stats_local.counts
+                try:
+                    counts[entry[1]] += 1
+                except KeyError:
+                    counts[entry[1]] = 1
+        if cls._subs is None:
+            return type.__instancecheck__(cls, instance)
+        return isinstance(instance, cls._subs)
+
+    def __subclasscheck__(cls, C):
+        warning = cls._warning
+        if warning is not None:
+            frame = _getframe(1)
+            entry = _sites.get((id(frame.f_code), frame.f_lasti, warning[0]))
+            filters = warnings.filters
+            if (entry is None or entry[2] is not filters or
+                    entry[3] is not (filters[0] if filters else None) or
+                    _samplers and warning[0] in _samplers):
+                _warn(*warning)
+            else:
+                counts = _stats_local.counts
+                try:
+                    counts[entry[1]] += 1
+                except KeyError:
+                    counts[entry[1]] = 1
+        if cls._subs is None:
+            return type.__subclasscheck__(cls, C)
+        return issubclass(C, cls._subs)
+
 
-    attrs = dict(__new__=__new__, __subclasshook__=__subclasshook__)
+class _LazyModule(types.ModuleType):
+    """Module type that honours PEP 562 `__getattr__` and `__dir__`.
 
-    return abc.ABCMeta(name, (object,), attrs)
+    Only needed before Python 3.7, where modules started doing this natively.
+    """
+
+    def __getattr__(self, name):
+        try:
+            getattr_ = self.__dict__['__getattr__']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr_(name)
+
+    def __dir__(self):
+        return self.__dict__['__dir__']()
+
+
+_lazy_lock = threading.RLock()
+
+
+def _lazy_module(name, doc, factories):
+    """Create a module whose attributes are built on first access.
+
+    factories maps attribute names to callables that take no arguments and
+    return the attribute's value. Once built, an attribute is stored in the
+    module like any other, so later lookups cost nothing extra.
+    """
+    if sys.version_info >= (3, 7):
+        mod = types.ModuleType(name, doc)
+    else:
+        mod = _LazyModule(name, doc)
+
+    def __getattr__(attr):
+        with _lazy_lock:
+            # NOTE: another thread may have built it while we waited
+            if attr in mod.__dict__:
+                return mod.__dict__[attr]
+
+            try:
+                factory = factories[attr]
+            except KeyError:
+                raise AttributeError('module {0!r} has no attribute '
+                                     '{1!r}'.format(name, attr))
+            value = factory()
+            setattr(mod, attr, value)
+            return value
+
+    def __dir__():
+        return sorted(set(mod.__dict__) | set(factories))
+
+    mod.__getattr__ = __getattr__
+    mod.__dir__ = __dir__
+    mod.__all__ = tuple(sorted(n for n in factories if not n.startswith('_')))
+
+    return mod
+
+
+def _lazy_reset(mod, factories):
+    """Forget the built attributes of a lazy module, so they get rebuilt."""
+    with _lazy_lock:
+        for attr in factories:
+            mod.__dict__.pop(attr, None)
+
+# Decimal strings of more digits than this are converted a piece at a time,
+# since CPython converts them in quadratic time (and recent Python 3 versions
+# refuse to by default).
+_digits_cutoff = 3000
+_ascii_digits = re.compile(r'[0-9]+\Z')
+
+
+def _pow10(k, cache):
+    """Return 10 ** k, remembering it in cache."""
+    try:
+        return cache[k]
+    except KeyError:
+        value = cache[k] = 5 ** k << k
+        return value
+
+
+def str2int(text):
+    """Convert a decimal string to an int, in subquadratic time.
+
+    Strings other than plain ASCII digits (with optional whitespace and sign)
+    are left to the native int.
+    """
+    if isinstance(text, bytes) and not PY2:
+        text = text.decode('latin1')
+    stripped = text.strip()
+    digits = stripped[1:] if stripped[:1] in ('+', '-') else stripped
+    if len(digits) <= _digits_cutoff or not _ascii_digits.match(digits):
+        return int(text)
+
+    cache = {}
+
+    def convert(lo, hi):
+        if hi - lo <= _digits_cutoff:
+            return int(digits[lo:hi])
+        mid = (lo + hi + 1) >> 1
+        return convert(lo, mid) * _pow10(hi - mid, cache) + convert(mid, hi)
+
+    value = convert(0, len(digits))
+    return -value if stripped[:1] == '-' else value
+
+
+def int2str(value):
+    """Convert an int to a decimal string.
+
+    Where the decimal module is implemented in C (Python 3.3 and later), it
+    does the conversion in subquadratic time. Otherwise, as on Python 2, the
+    value is split by powers of ten with divmod, which is still quadratic,
+    but faster than str.
+    """
+    value = operator.index(value)
+    if value < 0:
+        return '-' + int2str(-value)
+    if value.bit_length() <= _digits_cutoff * 3:
+        return str(value)
+
+    try:
+        import _decimal
+    except ImportError:
+        cache = {}
+
+        def convert(value, width):
+            if width <= _digits_cutoff:
+                return '%0*d' % (width, value)
+            half = width >> 1
+            high, low = divmod(value, _pow10(half, cache))
+            return convert(high, width - half) + convert(low, half)
+
+        # NOTE: this may be one digit too wide, which gives a leading zero
+        return convert(value, int(value.bit_length() * 0.30103) + 1).lstrip('0')
+
+    context = _decimal.Context(prec=_decimal.MAX_PREC, Emax=_decimal.MAX_EMAX,
+                               Emin=_decimal.MIN_EMIN)
+    powers = {}
+
+    def build(value, bits):
+        if bits <= _digits_cutoff * 3:
+            return _decimal.Decimal(value)
+        half = bits >> 1
+        high = value >> half
+        if half not in powers:
+            powers[half] = context.power(_decimal.Decimal(2), half)
+        return context.fma(build(high, bits - half), powers[half],
+                           build(value - (high << half), half))
+
+    return str(build(value, value.bit_length()))
+
+CompileCacheInfo = collections.namedtuple('CompileCacheInfo',
+                                          'hits misses maxsize currsize')
+
+
+class _CompileCache(object):
+    """Bounded LRU cache of the code objects made by `compile`.
+
+    Code objects are keyed by their source, filename, mode and flags, with
+    the caller's `__future__` flags already merged in by `compile`. Sources
+    other than strings (memoryview, bytearray and other buffers) are keyed by
+    a digest of their contents, so a cached one is never copied. ASTs, and
+    requests for an AST, always go straight to the native compile.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._codes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, compile_, source, filename, mode, flags=0,
+                 dont_inherit=False, *args, **kwargs):
+        key = None
+        if self.maxsize > 0 and not kwargs and not flags & _PyCF_ONLY_AST:
+            key = self._key(source)
+        if key is None:
+            return compile_(source, filename, mode, flags, dont_inherit,
+                            *args, **kwargs)
+
+        key = (key, filename, mode, flags, bool(dont_inherit)) + args
+        with self._lock:
+            code = self._codes.pop(key, None)
+            if code is not None:
+                self._codes[key] = code
+                self.hits += 1
+                return code
+            self.misses += 1
+
+        if not isinstance(source, (bytes, type(u''))):
+            source = memoryview(source).tobytes()
+        code = compile_(source, filename, mode, flags, dont_inherit, *args)
+        with self._lock:
+            self._codes[key] = code
+            while len(self._codes) > self.maxsize:
+                self._codes.popitem(last=False)
+        return code
+
+    @staticmethod
+    def _key(source):
+        """Return the part of the cache key for source, or None."""
+        if isinstance(source, (bytes, type(u''))):
+            return source
+        import hashlib
+        try:
+            return 'buffer', hashlib.sha1(source).digest()
+        except TypeError:
+            return None
+
+    def resize(self, maxsize):
+        """Keep at most maxsize code objects, dropping the oldest."""
+        with self._lock:
+            self.maxsize = maxsize
+            while self._codes and len(self._codes) > max(maxsize, 0):
+                self._codes.popitem(last=False)
+
+    def cache_info(self):
+        """Return the hits, misses, maximum and current size of the cache."""
+        with self._lock:
+            return CompileCacheInfo(self.hits, self.misses, self.maxsize,
+                                    len(self._codes))
+
+    def cache_clear(self):
+        """Forget every cached code object, and reset the statistics."""
+        with self._lock:
+            self._codes.clear()
+            self.hits = self.misses = 0
+
+
+_compile_cache = _CompileCache()
+_native_compile = compile
+_future_flags = functools.reduce(operator.or_, (
+    getattr(__future__, feature).compiler_flag
+    for feature in __future__.all_feature_names
+    if feature not in ('nested_scopes', 'generators')))
+
+
+def _cached_compile(source, filename, mode, flags=0, dont_inherit=False,
+                    optimize=-1, **kwargs):
+    # NOTE: the native compile would inherit the __future__ flags of this
+    # module rather than the caller's, so pass the caller's explicitly
+    if not dont_inherit:
+        flags |= _getframe(1).f_code.co_flags & _future_flags
+    args = () if PY2 else (optimize,)
+    return _compile_cache(_native_compile, source, filename, mode, flags,
+                          True, *args, **kwargs)
+
+
+_cached_compile.__name__ = 'compile'
+_cached_compile.__doc__ = compile.__doc__
+_cached_compile.cache_info = _compile_cache.cache_info
+_cached_compile.cache_clear = _compile_cache.cache_clear
 
 # build PY3 style builtins module from scratch
 if PY2:
@@ -104,67 +735,162 @@ if PY2:
     # TODO: duck punch the builtin `object` type to hide compatibility
     # issues (e.g., `__bool__` versus `__nonzero__`, `__next__` versus
     # `next`, etc.). This might be dangerous, but worth a try at least.
-    builtins = types.ModuleType('builtins')
     import __builtin__ as past_builtins
     import future_builtins
-
-    builtins._past_builtins = past_builtins
+    import binascii
+    import struct
 
     _to_remove = set(['apply', 'basestring', 'buffer', 'cmp', 'coerce',
                       'execfile', 'file', 'intern', 'long', 'raw_input',
                       'reduce', 'reload', 'unichr', 'unicode'])
     _to_add = set(n for n in dir(past_builtins) if not n.startswith('_'))
-    _to_add.update(('__import__', '__doc__'))
     _to_add -= _to_remove
+    _builtins_factories = {}
     for _attr in _to_add:
-        setattr(builtins, _attr, getattr(past_builtins, _attr))
+        _builtins_factories[_attr] = functools.partial(getattr, past_builtins,
+                                                       _attr)
 
     # duck punch old names that mean something different in Py3
-    for _set, _get in [('chr', 'unichr'), ('range', 'xrange'),
-                       ('bytes', 'str'), ('str', 'unicode'),
-                       ('input', 'raw_input')]:
-        setattr(builtins, _set, getattr(past_builtins, _get))
+    for _set, _get in [('chr', 'unichr'), ('bytes', 'str'),
+                       ('str', 'unicode'), ('input', 'raw_input')]:
+        _builtins_factories[_set] = functools.partial(getattr, past_builtins,
+                                                      _get)
 
     # old names with new semantics
     for _attr in ('ascii', 'filter', 'hex', 'map', 'oct', 'zip'):
-        setattr(builtins, _attr, getattr(future_builtins, _attr))
+        _builtins_factories[_attr] = functools.partial(getattr, future_builtins,
+                                                       _attr)
+
+    _builtins_factories['open'] = lambda: io.open
 
-    builtins.open = io.open
+    builtins = _lazy_module('builtins', past_builtins.__doc__,
+                            _builtins_factories)
+    builtins._past_builtins = past_builtins
+    builtins._BridgeMeta = _BridgeMeta
+    builtins._binascii = binascii
+    builtins._struct = struct
+    builtins._operator = operator
+    builtins._str2int = str2int
+    # whether `int` returns native ints for values that fit (see `configure`)
+    builtins._small_ints = False
+    builtins.__import__ = past_builtins.__import__
+
+    def _exec_builtin(name, source, uses=()):
+        """Build a builtin by running source in the `builtins` namespace."""
+        namespace = vars(builtins)
+        exec(source, namespace)
+        # NOTE: the source looks these up as globals when called, so make sure
+        # they are built, otherwise it would see the Python 2 builtins instead.
+        for other in uses:
+            getattr(builtins, other)
+        return namespace[name]
 
     # make builtins int act more like Python3 int (a la Python2 long)
-    exec("""class int(_past_builtins.long):
-    import abc
-    __metaclass__ = abc.ABCMeta
+    _builtins_factories['int'] = functools.partial(_exec_builtin, 'int', """class int(_past_builtins.long):
+    __metaclass__ = _BridgeMeta
+    _subs = (_past_builtins.int, _past_builtins.long)
+
+    # argument types that can't be invalid literals
+    _numbers = frozenset([_past_builtins.int, _past_builtins.long, float])
 
     def __new__(cls, x=0, *args, **kwargs):
-        # run super constructor first to cause other exceptions to be
-        # raised first.
-        self = super(int, cls).__new__(cls, x, *args, **kwargs)
+        if type(x) in cls._numbers and not (args or kwargs):
+            if _small_ints and cls is int:
+                value = _past_builtins.int(x)
+                if type(value) is _past_builtins.int:
+                    return value
+            return _past_builtins.long.__new__(cls, x)
+
+        if isinstance(x, (str, bytes)) and not (args or kwargs):
+            # NOTE: long converts long decimal strings in quadratic time
+            self = _past_builtins.long.__new__(cls, _str2int(x))
+        else:
+            # run super constructor first to cause other exceptions to be
+            # raised first.
+            self = super(int, cls).__new__(cls, x, *args, **kwargs)
         if isinstance(x, (str, bytes)) and x.endswith('L'):
             base = args[0] if args else kwargs.get('base', 10)
             raise ValueError("invalid literal for int() with base %r: '%s'" %
                              (base, x))
+        if _small_ints and cls is int:
+            value = _past_builtins.int(self)
+            if type(value) is _past_builtins.int:
+                return value
         return self
 
     def __repr__(self):
         return super(int, self).__repr__().rstrip('L')
 
-    @classmethod
-    def __subclasshook__(cls, C):
-        return issubclass(C, (_past_builtins.int, _past_builtins.long))""", vars(builtins))
+    # struct formats of the signed sizes that struct can pack directly
+    _formats = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+    def to_bytes(self, length, byteorder, signed=False):
+        if byteorder not in ('big', 'little'):
+            raise ValueError("byteorder must be either 'little' or 'big'")
+        if length < 0:
+            raise ValueError('length argument must be non-negative')
+        if self < 0 and not signed:
+            raise OverflowError("can't convert negative int to unsigned")
+
+        bits = 8 * length
+        if signed:
+            # NOTE: floor division, so that -1 fits in zero bytes
+            low, high = -(1 << bits) >> 1, 1 << bits >> 1
+        else:
+            low, high = 0, 1 << bits
+        if self and not low <= self < high:
+            raise OverflowError('int too big to convert')
+
+        # NOTE: not self._formats, so that native small ints can be passed
+        fmt = int._formats.get(length)
+        if fmt is not None:
+            order = '>' if byteorder == 'big' else '<'
+            return bytes(_struct.pack(order + (fmt if signed else fmt.upper()),
+                                      self))
 
-    exec("""class bytes(_past_builtins.bytes):
-    import abc as _abc
-    __metaclass__ = _abc.ABCMeta
+        value = self + (1 << bits) if self < 0 else self
+        data = _binascii.unhexlify(('%x' % value).zfill(2 * length)) if length else b''
+        return bytes(data if byteorder == 'big' else data[::-1])
+
+    @classmethod
+    def from_bytes(cls, bytes, byteorder, signed=False):
+        if byteorder not in ('big', 'little'):
+            raise ValueError("byteorder must be either 'little' or 'big'")
+        if not isinstance(bytes, _past_builtins.bytes):
+            bytes = _past_builtins.bytes(bytearray(bytes))
+        if byteorder == 'little':
+            bytes = bytes[::-1]
+
+        value = _past_builtins.long(_binascii.hexlify(bytes), 16) if bytes else 0
+        if signed and bytes and ord(bytes[:1]) & 0x80:
+            value -= 1 << 8 * len(bytes)
+        if cls is int:
+            # NOTE: even with small ints, so that it has to_bytes
+            return _past_builtins.long.__new__(cls, value)
+        return cls(value)""", ('str', 'bytes'))
+
+    _builtins_factories['bytes'] = functools.partial(_exec_builtin, 'bytes', """class bytes(_past_builtins.bytes):
+    __metaclass__ = _BridgeMeta
+    _subs = (_past_builtins.bytes,)
 
     def __new__(cls, source=0, encoding='utf-8', errors='strict'):
         if isinstance(source, int):
             return super(bytes, cls).__new__(cls, b'\\0' * source)
         elif isinstance(source, _past_builtins.basestring):
             return super(bytes, cls).__new__(cls, source)
-        else:  # assume an iterator of integers, such that: 0 <= integer < 256
-            _ = b''.join(map(_past_builtins.chr, source))
-            return super(bytes, cls).__new__(cls, _)
+
+        # like Python 3, try the buffer protocol first (e.g., bytearray,
+        # memoryview, array.array or mmap.mmap), as one bulk copy
+        try:
+            source = memoryview(source).tobytes()
+        except TypeError:
+            try:  # objects with only the old buffer protocol
+                source = _past_builtins.buffer(source)[:]
+            except TypeError:
+                # assume an iterator of integers, such that:
+                # 0 <= integer < 256
+                source = _past_builtins.bytes(bytearray(source))
+        return super(bytes, cls).__new__(cls, source)
 
     def __getitem__(self, index):
         if isinstance(index, slice):
@@ -172,17 +898,171 @@ if PY2:
         else:  # assume integral indexing
             return ord(super(bytes, self).__getitem__(index))
 
+    def __iter__(self):
+        # NOTE: one bulk copy, so that the ints come at C speed
+        return iter(bytearray(self))
+
     def __repr__(self):
         return 'b' + super(bytes, self).__repr__()
 
+    def hex(self):
+        return _binascii.hexlify(self).decode('ascii')
+
     @classmethod
-    def __subclasshook__(cls, C):
-        return issubclass(C, _past_builtins.bytes)""", vars(builtins))
+    def fromhex(cls, string):
+        if not isinstance(string, _past_builtins.basestring):
+            raise TypeError('fromhex() argument must be str, not %s' %
+                            type(string).__name__)
+        try:
+            # NOTE: like Python 3, only ASCII whitespace, and between pairs
+            pairs = string.encode('ascii').split()
+            if any(len(pair) % 2 for pair in pairs):
+                raise TypeError('odd-length string')
+            return cls(_binascii.unhexlify(b''.join(pairs)))
+        except (TypeError, UnicodeError):
+            raise ValueError('non-hexadecimal number found in fromhex() arg')""", ('int',))
+
+    _builtins_factories['range'] = functools.partial(_exec_builtin, 'range', """class range(object):
+    __slots__ = ('_start', '_stop', '_step', '_len')
+
+    # types whose membership can be computed rather than searched for
+    _ints = frozenset([_past_builtins.int, _past_builtins.long,
+                       _past_builtins.bool, int])
+
+    def __new__(cls, *args):
+        if not 1 <= len(args) <= 3:
+            raise TypeError('range expected 1 to 3 arguments, got %d' %
+                            len(args))
+        args = [_operator.index(arg) for arg in args]
+        if len(args) == 1:
+            start, stop, step = 0, args[0], 1
+        else:
+            start, stop, step = (args + [1])[:3]
+        if step == 0:
+            raise ValueError('range() arg 3 must not be zero')
+
+        self = super(range, cls).__new__(cls)
+        self._start, self._stop, self._step = start, stop, step
+        if step > 0 and start < stop:
+            self._len = (stop - start - 1) // step + 1
+        elif step < 0 and start > stop:
+            self._len = (start - stop - 1) // -step + 1
+        else:
+            self._len = 0
+        return self
+
+    start = property(lambda self: self._start)
+    stop = property(lambda self: self._stop)
+    step = property(lambda self: self._step)
+
+    def __len__(self):
+        return self._len
+
+    def __nonzero__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        try:  # as fast as it gets, when the bounds fit in a C long
+            return iter(_past_builtins.xrange(self._start, self._stop,
+                                              self._step))
+        except OverflowError:
+            return self._iter_long()
+
+    def _iter_long(self):
+        value, step, remaining = self._start, self._step, self._len
+        while remaining:
+            yield value
+            value += step
+            remaining -= 1
+
+    def __reversed__(self):
+        return iter(self[::-1])
+
+    def __contains__(self, value):
+        if type(value) not in self._ints:
+            return any(value == item for item in self)
+        if self._step > 0:
+            if not self._start <= value < self._stop:
+                return False
+        elif not self._stop < value <= self._start:
+            return False
+        return (value - self._start) % self._step == 0
+
+    def index(self, value):
+        if type(value) in self._ints:
+            if value in self:
+                return (value - self._start) // self._step
+        else:
+            for index, item in enumerate(self):
+                if value == item:
+                    return index
+        raise ValueError('%r is not in range' % (value,))
 
-    exec("""def compile(source, filename, mode, flags=0, dont_inherit=False, optimize=-1, **kwargs):
-    if isinstance(source, memoryview):
-        source = source.tobytes()
-    return _past_builtins.compile(source, filename, mode, flags, dont_inherit, **kwargs)""", vars(builtins))
+    def count(self, value):
+        if type(value) in self._ints:
+            return _past_builtins.int(value in self)
+        return sum(1 for item in self if value == item)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+
+        index = _operator.index(index)
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('range object index out of range')
+        return self._start + index * self._step
+
+    def _slice(self, index):
+        # NOTE: like slice.indices, but without any limit on the length
+        length = self._len
+        step = 1 if index.step is None else _operator.index(index.step)
+        if step == 0:
+            raise ValueError('slice step cannot be zero')
+        lower, upper = (-1, length - 1) if step < 0 else (0, length)
+
+        def clamp(value, default):
+            if value is None:
+                return default
+            value = _operator.index(value)
+            if value < 0:
+                return max(value + length, lower)
+            return min(value, upper)
+
+        start = clamp(index.start, upper if step < 0 else lower)
+        stop = clamp(index.stop, lower if step < 0 else upper)
+        return range(self._start + start * self._step,
+                     self._start + stop * self._step, self._step * step)
+
+    def __eq__(self, other):
+        if not isinstance(other, range):
+            return NotImplemented
+        if self._len != other._len:
+            return False
+        return (self._len == 0 or (self._start == other._start and
+                                   (self._len == 1 or self._step == other._step)))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        if self._len == 0:
+            return hash((0, None, None))
+        elif self._len == 1:
+            return hash((1, self._start, None))
+        return hash((self._len, self._start, self._step))
+
+    def __reduce__(self):
+        return type(self), (self._start, self._stop, self._step)
+
+    def __repr__(self):
+        if self._step == 1:
+            return 'range(%d, %d)' % (self._start, self._stop)
+        return 'range(%d, %d, %d)' % (self._start, self._stop, self._step)""", ('int',))
+
+    _builtins_factories['compile'] = lambda: _cached_compile
 
     # TODO: duck punch `itertools.filterfalse` as an alias to `itertools.ifilterfalse`
     # TODO: wrap `itertools.imap`, `itertools.ifilter` and
@@ -190,7 +1070,7 @@ if PY2:
     # `filterfalse` alias, so that it doesn't pick up the warning). Have the
     # warning point to the `six`, `future` and `dpthree` modules as compatibility options.
 
-    del past_builtins, _to_add, _to_remove, future_builtins
+    del past_builtins, _to_add, _to_remove, future_builtins, binascii, struct
 
     # This is only needed on PY2
     sys.modules['builtins'] = builtins
@@ -206,26 +1086,118 @@ sys.modules['.'.join([__name__, builtins.__name__])] = builtins
 # exist, but not by these names). They shouldn't be used, but can be helpful in
 # getting Python 2 code to run in Python 3 with fewer modifications. Use of
 # any of these raises a DeprecationWarning.
-removed = types.ModuleType('removed', ('Builtins removed in Python 3.0 and '
-                                       'above.\n\nNoteworthy: all callables '
-                                       'in this module print/raise a '
-                                       'DeprecationWarning when used.'))
-sys.modules['.'.join([__name__, removed.__name__])] = removed
-
 def _bs_raise(*args, **kwargs):
     """Pseudo constructor for basestring."""
     raise TypeError('The basestring type cannot be instantiated')
 
-removed.basestring = _class_warn(_bs_raise,
-                                 subs=(basestring,) if PY2 else (str, bytes),
-                                 name='basestring')
-removed.unicode = _class_warn(builtins.str, name='unicode')
-removed.xrange = _class_warn(builtins.range, name='xrange')
-removed.reduce = _func_warn(functools.reduce, 'reduce')
-removed.raw_input = _func_warn(builtins.input, 'raw_input')
-removed.unichr = _func_warn(builtins.chr, 'unichr')
 
-del _bs_raise
+def _buffer(object, offset=0, size=-1):
+    """buffer(object [, offset[, size]])
+
+    Create a new read-only view of the bytes of an object that supports the
+    buffer interface (bytes, bytearray, mmap, array, ...). The view starts at
+    offset and holds at most size bytes, or up to the end of the object if
+    size is -1. Unlike slicing the object, this copies nothing, and neither
+    does slicing the view. Before Python 3.8, memoryview can't make a view of
+    a writable object read-only, so those bytes are copied instead, and the
+    result doesn't see later changes to the object.
+    """
+    if offset < 0:
+        raise ValueError('offset must be zero or positive')
+    if size < -1:
+        raise ValueError('size must be zero or positive')
+    view = memoryview(object)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    view = view[offset:] if size == -1 else view[offset:offset + size]
+    if not view.readonly:
+        if hasattr(view, 'toreadonly'):
+            view = view.toreadonly()
+        else:
+            view = memoryview(view.tobytes())
+    return view
+
+
+def _cmp(x, y):
+    """cmp(x, y) -> integer
+
+    Return negative if x<y, zero if x==y, positive if x>y.
+    """
+    return (x > y) - (x < y)
+
+
+# Code objects of the scripts run by `execfile`, by path and inherited
+# __future__ flags, each with the stat of the script when it was compiled.
+_execfile_codes = {}
+_max_execfile_codes = 256
+
+
+def _execfile(filename, globals=None, locals=None):
+    """execfile(filename[, globals[, locals]])
+
+    Read and execute a Python script from a file. The globals and locals are
+    dictionaries, defaulting to the current globals and locals. If only
+    globals is given, locals defaults to it. The script is only read and
+    compiled again when the file at its absolute path changes.
+    """
+    # NOTE: skip the deprecation wrapper to get to the real caller
+    frame = sys._getframe(1)
+    while frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    # like the native execfile, the script inherits the caller's __future__
+    flags = frame.f_code.co_flags & _future_flags
+    if globals is None:
+        globals = frame.f_globals
+        if locals is None:
+            locals = frame.f_locals
+    elif locals is None:
+        locals = globals
+    del frame
+
+    # NOTE: the same path can name another file after a chdir or a rename
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    version = (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size,
+               stat.st_ino, stat.st_dev)
+    cached = _execfile_codes.get((path, flags))
+    if (cached is not None and cached[0] == version and
+            cached[1].co_filename == filename):
+        code = cached[1]
+    else:
+        with io.open(path, 'rb') as script:
+            source = script.read()
+        code = _native_compile(source, filename, 'exec', flags, True)
+        if len(_execfile_codes) >= _max_execfile_codes:
+            _execfile_codes.clear()
+        _execfile_codes[path, flags] = version, code
+    exec(code, globals, locals)
+
+
+_removed_factories = {
+    # NOTE: on PY2 the real basestring can be used as is in production mode
+    'basestring': lambda: (_class_warn(basestring) if PY2 else
+                           _class_warn(_bs_raise, subs=(str, bytes),
+                                       name='basestring')),
+    'unicode': lambda: _class_warn(builtins.str, name='unicode'),
+    'xrange': lambda: _class_warn(builtins.range, name='xrange'),
+    'reduce': lambda: _func_warn(functools.reduce, 'reduce'),
+    'raw_input': lambda: _func_warn(builtins.input, 'raw_input'),
+    'unichr': lambda: _func_warn(builtins.chr, 'unichr'),
+    'execfile': lambda: _func_warn(_execfile, 'execfile'),
+    # NOTE: on PY2 the real cmp can be used as is
+    'cmp': lambda: _func_warn(cmp if PY2 else _cmp, 'cmp'),
+    # NOTE: on PY2 the real buffer can be used as is
+    'buffer': lambda: (_class_warn(buffer) if PY2 else
+                       _class_warn(_buffer, subs=(memoryview,),
+                                   name='buffer')),
+}
+
+removed = _lazy_module('removed', ('Builtins removed in Python 3.0 and '
+                                   'above.\n\nNoteworthy: all callables '
+                                   'in this module print/raise a '
+                                   'DeprecationWarning when used.'),
+                       _removed_factories)
+sys.modules['.'.join([__name__, removed.__name__])] = removed
 
 # kludges for things that have no new equivalent in Python 3.
 _kludge_doc = ('Kludges for Python 2 builtins that have no equivalent in '
@@ -235,12 +1207,21 @@ _kludge_doc = ('Kludges for Python 2 builtins that have no equivalent in '
                'solutions from the dpthree source.\n\nNoteworthy: all '
                'callables in this module print/raise a DeprecationWarning '
                'when used.')
-kludges = types.ModuleType('kludges', _kludge_doc)
-sys.modules['.'.join([__name__, kludges.__name__])] = kludges
+
+
+# one byte byte strings, by ordinal
+_bytechrs = tuple(bytes(bytearray((i,))) for i in range(256))
 
 
 def bytechr(i):
     """Return bytestring of one character with ordinal i; 0 <= i < 256."""
+    # NOTE: negative ints would index the table from the end
+    if i >= 0:
+        try:
+            return _bytechrs[i]
+        except (IndexError, TypeError):
+            pass
+
     if not 0 <= i < 256:
         if not isinstance(i, int):
             raise TypeError('an integer is required')
@@ -251,24 +1232,383 @@ def bytechr(i):
 if PY2:
     bytechr = chr
 
+
+def bytechrs(iterable):
+    """Return bytestring of the characters with the ordinals in iterable."""
+    return bytes(bytearray(iter(iterable)))
+
+
+class bytestr(bytes):
+    """Byte string that indexes and iterates like the Python 2 str type.
+
+    Items are one byte byte strings rather than ints. These all come from a
+    table, so indexing and iterating allocate nothing per byte.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return bytestr(bytes.__getitem__(self, index))
+        return _bytechrs[bytes.__getitem__(self, index)]
+
+    def __iter__(self):
+        return map(_bytechrs.__getitem__, bytes.__iter__(self))
+
+if PY2:
+    bytestr = str
+
+# The builtin cmp functions, which compare exactly like sorting by the values.
+_native_cmps = (_cmp, cmp) if PY2 else (_cmp,)
+
+# What the cmp functions given to `sorted_cmp` compare, by code object: the
+# (cmp name, access path, reversed) terms of key-based ones, or None. Only the
+# most recently used ones are kept.
+_cmp_terms = collections.OrderedDict()
+_cmp_terms_lock = threading.Lock()
+_max_cmp_terms = 256
+
+
+def _access_path(node, name):
+    """Return the attributes and items node looks up on name, or None."""
+    import ast
+    path = []
+    while not (isinstance(node, ast.Name) and node.id == name):
+        if isinstance(node, ast.Attribute):
+            path.append(('attr', node.attr))
+        elif isinstance(node, ast.Subscript):
+            index = node.slice
+            # NOTE: before Python 3.9, constant indexes are wrapped in Index
+            if type(index).__name__ == 'Index':
+                index = index.value
+            try:
+                path.append(('item', ast.literal_eval(index)))
+            except ValueError:
+                return None
+        else:
+            return None
+        node = node.value
+    return path[::-1]
+
+
+def _dotted_name(node):
+    """Return the dotted name node refers to, or None."""
+    import ast
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _dotted_name(node.value)
+        return None if base is None else base + '.' + node.attr
+    return None
+
+
+def _key_terms(node, a, b):
+    """Return the terms of a key-based cmp expression of a and b, or None.
+
+    That is, a call of a cmp function with the same path of attributes and
+    items of a and b (in either order), or such calls joined by `or`.
+    """
+    import ast
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
+        terms = []
+        for value in node.values:
+            more = _key_terms(value, a, b)
+            if more is None:
+                return None
+            terms.extend(more)
+        return terms
+
+    if (not isinstance(node, ast.Call) or len(node.args) != 2 or
+            node.keywords or getattr(node, 'starargs', None) or
+            getattr(node, 'kwargs', None)):
+        return None
+    name = _dotted_name(node.func)
+    for descending, (x, y) in ((False, (a, b)), (True, (b, a))):
+        path = _access_path(node.args[0], x)
+        if path is not None and path == _access_path(node.args[1], y):
+            return [(name, path, descending)] if name else None
+    return None
+
+
+def _lambda_sources(code, lines, first):
+    """Yield the candidate sources of a lambda, longest first.
+
+    Its source lines may hold more than the lambda, e.g. the end of the call
+    it is an argument to. Where code objects have positions (Python 3.11+),
+    the lambda is cut exactly where its body ends. Otherwise only closing
+    brackets, commas and whitespace may be cut from the end of the lines,
+    since cutting anything else can leave a shorter, different lambda.
+    """
+    source = ''.join(lines)
+    ends = [(line, column)
+            for _, line, _, column in getattr(code, 'co_positions', list)()
+            if line is not None and column is not None]
+    if ends:
+        line, column = max(ends)
+        last = lines[line - first].encode('utf-8')[:column].decode('utf-8')
+        yield ''.join(lines[:line - first]) + last
+        return
+
+    shortest = len(source.rstrip(' \t\r\n)]},'))
+    for end in range(len(source), shortest - 1, -1):
+        yield source[:end]
+
+
+def _parse_cmp(code):
+    """Return the terms of the cmp function of code, if it is key-based."""
+    import ast
+    import inspect
+    import textwrap
+    try:
+        lines, first = inspect.getsourcelines(code)
+    except (IOError, TypeError):
+        return None
+
+    tree = None
+    if code.co_name != '<lambda>':
+        try:
+            tree = ast.parse(textwrap.dedent(''.join(lines)))
+        except SyntaxError:
+            return None
+    elif ''.join(lines).count('lambda') == 1:
+        # NOTE: there's no telling which of several lambdas on the lines it is
+        for source in _lambda_sources(code, lines, first):
+            # NOTE: the brackets let the lambda go on over several lines
+            try:
+                tree = ast.parse('(%s\n)' % source[source.find('lambda'):])
+                break
+            except SyntaxError:
+                pass
+    if tree is None:
+        return None
+
+    names = list(code.co_varnames[:2])
+    bodies = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Lambda):
+            body = node.body
+        elif (isinstance(node, ast.FunctionDef) and
+              node.name == code.co_name and
+              isinstance(node.body[-1], ast.Return)):
+            # NOTE: anything but a docstring before the return disqualifies
+            if len(node.body) > (1 if ast.get_docstring(node) is None else 2):
+                continue
+            body = node.body[-1].value
+        else:
+            continue
+        args = [getattr(arg, 'arg', getattr(arg, 'id', None))
+                for arg in node.args.args]
+        if args == names and not node.args.defaults:
+            bodies.append(body)
+
+    if len(bodies) != 1 or bodies[0] is None:
+        return None
+    terms = _key_terms(bodies[0], *names)
+    if terms is None or not _same_code(code, tree):
+        return None
+    return terms
+
+
+def _same_code(code, tree):
+    """Return whether tree holds a function compiling to code.
+
+    The source on disk may have changed since code was compiled from it.
+    """
+    import ast
+    if code.co_freevars:
+        # NOTE: the free variables need an enclosing function to be bound in
+        outer = ast.parse('def outer():\n    %s = None\n' %
+                          ' = '.join(code.co_freevars))
+        outer.body[0].body.extend(tree.body)
+        tree = outer
+    try:
+        compiled = _native_compile(tree, code.co_filename, 'exec',
+                                   code.co_flags & _future_flags, True)
+    except (SyntaxError, TypeError, ValueError):
+        return False
+
+    codes = [compiled]
+    while codes:
+        other = codes.pop()
+        if (other.co_name == code.co_name and
+                other.co_code == code.co_code and
+                other.co_names == code.co_names and
+                other.co_consts == code.co_consts and
+                other.co_varnames == code.co_varnames and
+                other.co_freevars == code.co_freevars):
+            return True
+        codes.extend(const for const in other.co_consts
+                     if isinstance(const, types.CodeType))
+    return False
+
+
+def _resolve(function, name):
+    """Look up a dotted name the way the code of function would."""
+    code = function.__code__
+    first, _, rest = name.partition('.')
+    if first in code.co_freevars:
+        value = function.__closure__[code.co_freevars.index(first)]
+        value = value.cell_contents
+    elif first in function.__globals__:
+        value = function.__globals__[first]
+    else:
+        namespace = function.__globals__.get('__builtins__', {})
+        if not isinstance(namespace, dict):
+            namespace = vars(namespace)
+        value = namespace[first]
+    for attr in rest.split('.') if rest else ():
+        value = getattr(value, attr)
+    return value
+
+
+def _paths_getter(paths):
+    """Return a function that follows access paths from _access_path.
+
+    It returns a tuple of values for more than one path.
+    """
+    kinds = set(kind for path in paths for kind, _ in path)
+    # NOTE: these fetch everything in C, tuples included
+    if kinds == set(['attr']):
+        return operator.attrgetter(*['.'.join(attr for _, attr in path)
+                                     for path in paths])
+    if kinds == set(['item']) and all(len(path) == 1 for path in paths):
+        return operator.itemgetter(*[path[0][1] for path in paths])
+
+    def follow(value, path):
+        for kind, step in path:
+            value = getattr(value, step) if kind == 'attr' else value[step]
+        return value
+
+    if len(paths) == 1:
+        return lambda value: follow(value, paths[0])
+    return lambda value: tuple([follow(value, path) for path in paths])
+
+
+def _cmp_key(cmp):
+    """Return the (key, reversed) a cmp function sorts like, or None."""
+    if getattr(cmp, '__wrapped__', cmp) in _native_cmps:
+        return None, False
+
+    code = getattr(cmp, '__code__', None)
+    if code is None or code.co_argcount != 2:
+        return None
+    with _cmp_terms_lock:
+        terms = _cmp_terms.pop(code, _cmp_terms)
+        if terms is not _cmp_terms:
+            _cmp_terms[code] = terms
+    if terms is _cmp_terms:
+        terms = _parse_cmp(code)
+        with _cmp_terms_lock:
+            _cmp_terms[code] = terms
+            while len(_cmp_terms) > _max_cmp_terms:
+                _cmp_terms.popitem(last=False)
+    if not terms or len(set(term[2] for term in terms)) != 1:
+        return None
+
+    for name, _, _ in terms:
+        try:
+            function = _resolve(cmp, name)
+        except (AttributeError, KeyError, ValueError):
+            return None
+        if getattr(function, '__wrapped__', function) not in _native_cmps:
+            return None
+
+    return _paths_getter([path for _, path, _ in terms]), terms[0][2]
+
+
+def _compose(outer, inner):
+    """Return a function calling outer on the result of inner."""
+    def composed(value):
+        return outer(inner(value))
+    return composed
+
+
+def sorted_cmp(iterable, cmp, key=None, reverse=False):
+    """Return a new list of the items in iterable, sorted with cmp.
+
+    Sorts like sorted(iterable, cmp, key, reverse) did in Python 2. When cmp
+    only compares the same attributes or items of its two arguments with the
+    builtin cmp, like `lambda a, b: cmp(a.x, b.x)`, the items are sorted by
+    those values instead, and cmp is never called. Otherwise cmp is called
+    for every comparison, through functools.cmp_to_key.
+    """
+    found = _cmp_key(cmp)
+    if found is None:
+        by = functools.cmp_to_key(cmp)
+    else:
+        by, descending = found
+        reverse = bool(reverse) != descending
+    if key is not None:
+        by = key if by is None else _compose(by, key)
+    return sorted(iterable, key=by, reverse=reverse)
+
+
 _kldgmsg = ('The function/class "{name}" exists in neither versions 2 nor 3 '
             'of Python. It is merely a kludge to help cover up differences '
             'between the two versions.')
 
-# since PY3 chr only works with unicode, this callable gives the Python 2
-# behavior of chr
-kludges.bytechr = _func_warn(bytechr, name='bytechr', msg=_kldgmsg)
 
-# TODO: for PY3 make `bytestr` class that is like PY2 str class for use in PY3
+_kludges_factories = {
+    # since PY3 chr only works with unicode, this callable gives the Python 2
+    # behavior of chr
+    'bytechr': lambda: _func_warn(bytechr, name='bytechr', msg=_kldgmsg),
+    # many bytechr results joined together, in one go
+    'bytechrs': lambda: _func_warn(bytechrs, name='bytechrs', msg=_kldgmsg),
+    # decimal string conversions faster than int and str on big values
+    'int2str': lambda: _func_warn(int2str, name='int2str', msg=_kldgmsg),
+    'str2int': lambda: _func_warn(str2int, name='str2int', msg=_kldgmsg),
+    # bytes that index and iterate like PY2 str
+    'bytestr': lambda: _class_warn(bytestr, name='bytestr', msg=_kldgmsg),
+    # sorting with Python 2 cmp functions, by key where they allow it
+    'sorted_cmp': lambda: _func_warn(sorted_cmp, name='sorted_cmp',
+                                     msg=_kldgmsg),
+}
+
+kludges = _lazy_module('kludges', _kludge_doc, _kludges_factories)
+sys.modules['.'.join([__name__, kludges.__name__])] = kludges
+
 # TODO: for PY3 make `nativestr` kludge that is PY2 `str` class in PY2 and PY3 `str` class in PY3
 
-del _kludge_doc, _kldgmsg
+del _kludge_doc
+
+
+def configure(production=None, small_ints=None, compile_cache=None):
+    """Change how dpthree behaves after it has been imported.
+
+    When production is true, the names in `removed` and `kludges` are bound
+    straight to the callables and types they stand in for, so they cost
+    exactly what the native ones do and never warn. This is the same as
+    setting the DPTHREE_PRODUCTION environment variable before import. Names
+    imported from those modules before calling this keep their old binding.
+
+    When small_ints is true, `builtins.int` on Python 2 returns native ints
+    for values that fit in one, rather than longs, as their arithmetic is
+    much faster. These still pass `isinstance(value, builtins.int)`, but lack
+    the methods of `builtins.int`, so `builtins.int(5).to_bytes` raises
+    AttributeError; call `builtins.int.to_bytes(value, ...)` instead.
+    `builtins.int.from_bytes` still returns a `builtins.int`. It has no
+    effect on Python 3.
+
+    compile_cache is the most code objects `builtins.compile` keeps, and 0
+    turns the cache off. On Python 2 the cache is on by default. On Python 3
+    `builtins` is the real builtins module, so a cache size above 0 also
+    replaces the native compile there, for the whole interpreter, and 0 puts
+    the native one back.
+    """
+    global _production
+    if production is not None:
+        _production = bool(production)
+        _lazy_reset(removed, _removed_factories)
+        _lazy_reset(kludges, _kludges_factories)
+    if small_ints is not None and PY2:
+        builtins._small_ints = bool(small_ints)
+    if compile_cache is not None:
+        _compile_cache.resize(compile_cache)
+        if not PY2:
+            builtins.compile = (_cached_compile if compile_cache > 0
+                                else _native_compile)
 
 # moved or renamed
-modules = types.ModuleType('modules', 'Moved or renamed modules. Some of '
-                           'these have extra or changed members.')
-sys.modules['.'.join([__name__, modules.__name__])] = modules
-
 _name_map = {'winreg': '_winreg',
              'configparser': 'ConfigParser',
              'copyreg': 'copy_reg',
@@ -278,73 +1618,108 @@ _name_map = {'winreg': '_winreg',
              'reprlib': 'repr',
              'tkinter': 'Tkinter'}
 
-if PY2:
-    _names = _name_map.items()
-else:
-    _names = list(_name_map.keys())
-    _names = zip(_names, _names)
-
-for _new, _old in _names:
+# tkinter submodules, by their new and old names
+_tk_map = {'scrolledtext': 'ScrolledText',
+           'colorchooser': 'tkColorChooser',
+           'commondialog': 'tkCommonDialog',
+           'filedialog': 'tkFileDialog',
+           'font': 'tkFont',
+           'messagebox': 'tkMessageBox',
+           'simpledialog': 'tkSimpleDialog',
+           'dnd': 'Tkdnd',
+           'ttk': 'ttk',
+           'tix': 'Tix',
+           'constants': 'Tkconstants'}
+
+
+def _import_renamed(new):
+    """Return a renamed module as an attribute of the `modules` module."""
     try:
-        _mod = __import__(_old, level=0)
-    except ImportError:
-        continue
-    else:
-        setattr(modules, _new, _mod)
-        # duck punch relative to internal sub-module
-        sys.modules['.'.join([__name__, 'modules', _new])] = _mod
-        # also duck punch module module name as a top level name
-        sys.modules[_new] = _mod
+        return importlib.import_module('.'.join([__name__, 'modules', new]))
+    except ImportError as e:
+        raise AttributeError(str(e))
+
+modules = _lazy_module('modules', 'Moved or renamed modules. Some of these '
+                       'have extra or changed members.',
+                       dict((_new, functools.partial(_import_renamed, _new))
+                            for _new in _name_map))
+# NOTE: not every renamed module exists everywhere (e.g., winreg), so star
+# imports only get the ones that have already been imported.
+del modules.__all__
+# NOTE: submodules can only be imported from packages
+modules.__path__ = []
+sys.modules['.'.join([__name__, modules.__name__])] = modules
 
-##################
-# module renames #
-##################
 
-# TODO: change this to a sequence of pairs. Keeping them in sync as two separate
-# sequences is a pain. (Why did I even do this in the first place?!)
-_tk_old = ('ScrolledText', 'tkColorChooser', 'tkCommonDialog', 'tkFileDialog',
-           'tkFont', 'tkMessageBox', 'tkSimpleDialog', 'Tkdnd', 'ttk', 'Tix',
-           'Tkconstants')
-_tk_new = ('scrolledtext', 'colorchooser', 'commondialog', 'filedialog',
-           'font', 'messagebox', 'simpledialog', 'dnd', 'ttk', 'tix',
-           'constants')
+class _RenamedModuleFinder(object):
+    """Import hook that loads renamed modules by their new names on demand.
 
+    This covers the `dpthree.modules` submodules (including the tkinter
+    submodules) and, on Python 2, the new top level names (e.g., `import
+    queue` imports the `Queue` module and `import tkinter.font` the `tkFont`
+    module).
+    """
 
-def _dp_tk2():
-    mod = __import__('Tkinter', level=0)
-    sys.modules['tkinter'] = mod
-    for old, new in zip(_tk_old, _tk_new):
-        try:
-            smod = __import__(old, level=0)
-        except ImportError as e:
-            continue
+    prefix = '.'.join([__name__, 'modules', ''])
+
+    def _real_name(self, fullname):
+        """Return the real name of the module that fullname stands for."""
+        if fullname.startswith(self.prefix):
+            new = fullname[len(self.prefix):]
+        elif PY2:
+            new = fullname
         else:
-            setattr(mod, new, smod)
-            sys.modules['tkinter.' + new] = smod
+            return None
 
-    return mod
+        if new in _name_map:
+            return _name_map[new] if PY2 else new
+
+        package, _, sub = new.rpartition('.')
+        if package == 'tkinter' and sub in _tk_map:
+            return _tk_map[sub] if PY2 else new
+
+        return None
 
-def _dp_tk3():
-    # NOTE: although these exist in PY3, we make sure they are loaded, otherwise
-    # submodule imports for dpthree.modules.tkinter will not work properly
-    for _name in _tk_new:
+    def find_module(self, fullname, path=None):
+        """Find renamed modules for the PEP 302 import protocol."""
+        return self if self._real_name(fullname) is not None else None
+
+    def load_module(self, fullname):
+        """Load renamed modules for the PEP 302 import protocol."""
         try:
-            __import__('tkinter.' + _name, level=0)
-        except ImportError as e:
+            return sys.modules[fullname]
+        except KeyError:
             pass
 
-if hasattr(modules, 'tkinter'):
-    if PY2:
-        _dp_tk2()
-    else:
-        _dp_tk3()
+        mod = importlib.import_module(self._real_name(fullname))
+        if PY2 and mod.__name__ == 'Tkinter':
+            # NOTE: Python 2 only looks for submodules (e.g., tkinter.font) in
+            # packages, and Tkinter is a plain module.
+            mod.__path__ = []
+        sys.modules[fullname] = mod
+        return mod
+
+    def find_spec(self, fullname, path=None, target=None):
+        """Find renamed modules for the PEP 451 import protocol."""
+        if self._real_name(fullname) is None:
+            return None
+        return spec_from_loader(fullname, self)
 
-    for _name in _tk_new:
-        if hasattr(modules.tkinter, _name):
-            sys.modules['.'.join([__name__, 'modules.tkinter', _name])] = getattr(modules.tkinter, _name)
+    def create_module(self, spec):
+        """Return the renamed module itself, rather than a new one."""
+        mod = self.load_module(spec.name)
+        spec.loader_state = getattr(mod, '__spec__', None)
+        return mod
+
+    def exec_module(self, module):
+        """Undo the import system setting our spec on the renamed module."""
+        module.__spec__ = module.__spec__.loader_state
 
-del _tk_old, _tk_new
+sys.meta_path.insert(0, _RenamedModuleFinder())
 
+##################
+# module renames #
+##################
 
 def _load_dbm():
     dbm = types.ModuleType('dbm', '')
@@ -370,28 +1745,122 @@ def _load_dbm():
     return mod
 
 
+_import_locks = {}
+_import_locks_lock = threading.Lock()
+
+
+def _import_lock(name):
+    """Return the lock that guards loading a module by its new name."""
+    try:
+        return _import_locks[name]
+    except KeyError:
+        with _import_locks_lock:
+            return _import_locks.setdefault(name, threading.Lock())
+
+
 def _loadnewname(name):
     """Load modules by their new names."""
     if PY2 and name in _name_map:
-        mods = sys.modules
-        sys.modules = {}
         try:
-            if name == 'dbm':
-                mod = _load_dbm()
-            elif name == 'tkinter':
-                mod = _dp_tk_subs2()
-            else:
-                mod = __import__(_name_map[name], level=0)
-            sys.modules[name] = mod
-        finally:
-            mods.update(sys.modules)
-            sys.modules = mods
+            return sys.modules[name]
+        except KeyError:
+            pass
+
+        # NOTE: the import goes through `_RenamedModuleFinder`, which never
+        # touches any other entry of `sys.modules`.
+        with _import_lock(name):
+            return importlib.import_module(name)
 
 
 def loadnewnames():
     if PY2:
         for new in _name_map:
-            _loadnewname(new)
+            try:
+                _loadnewname(new)
+            except ImportError:  # e.g., winreg on anything but Windows
+                continue
+
+
+PreloadReport = collections.namedtuple('PreloadReport',
+                                       'loaded failed frozen seconds')
+
+
+def _preload_module(fullname, loaded, failed):
+    """Import one module for `preload`, recording how it went."""
+    try:
+        importlib.import_module(fullname)
+    except ImportError:  # e.g., winreg on anything but Windows
+        failed.append(fullname)
+    else:
+        loaded.append(fullname)
+
+
+def preload(names=None, parallel=True, tkinter=False, freeze=True):
+    """Build everything dpthree would otherwise build on first use.
+
+    Meant to be called in the master process of a prefork server, so that the
+    workers share these objects instead of each building their own copy.
+
+    names are the new names of the renamed modules to import (by default all
+    of them but tkinter), and if tkinter is true tkinter and its submodule
+    aliases are imported as well. If parallel is true, the modules are
+    imported from several threads at once, except on Python 2 and while the
+    import lock is held, where they are imported one by one. Every name in
+    `builtins`, `removed` and `kludges` is built too. Finally, if freeze is
+    true and the gc module has a freeze function, all objects are moved out
+    of reach of the garbage collector, so that collections in the workers
+    don't write to the shared pages.
+
+    Returns a PreloadReport of (loaded, failed, frozen, seconds): the sorted
+    names of the modules that were and were not imported, whether the objects
+    were frozen, and how long this took.
+    """
+    start = _clock()
+
+    if names is None:
+        # NOTE: importing tkinter maps the Tcl/Tk libraries, which headless
+        # processes are better off without
+        names = [name for name in _name_map if tkinter or name != 'tkinter']
+    fullnames = [_RenamedModuleFinder.prefix + name for name in sorted(names)]
+
+    loaded, failed = [], []
+    # NOTE: the threads would wait forever on the import lock if it is held,
+    # e.g. when this runs at the top level of a module being imported. On
+    # Python 2 that lock is held for the whole import, so it is never worth it.
+    if PY2:
+        parallel = False
+    elif parallel:
+        import _imp
+        parallel = not _imp.lock_held()
+    if parallel:
+        threads = [threading.Thread(target=_preload_module,
+                                    args=(fullname, loaded, failed))
+                   for fullname in fullnames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for fullname in fullnames:
+            _preload_module(fullname, loaded, failed)
+
+    if tkinter:
+        # NOTE: these all need the tkinter module itself, so there is nothing
+        # to gain from importing them in parallel.
+        for sub in sorted(_tk_map):
+            _preload_module(_RenamedModuleFinder.prefix + 'tkinter.' + sub,
+                            loaded, failed)
+
+    for mod in (builtins, removed, kludges) if PY2 else (removed, kludges):
+        for attr in mod.__all__:
+            getattr(mod, attr)
+
+    frozen = freeze and hasattr(gc, 'freeze')
+    if frozen:
+        gc.freeze()
+
+    return PreloadReport(tuple(sorted(loaded)), tuple(sorted(failed)), frozen,
+                         _clock() - start)
 
 #######################
 # module duck punches #
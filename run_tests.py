@@ -20,7 +20,9 @@ def parse_args(args=sys.argv):
     parser.add_argument('-l', '--level', action='count', default=0, help='Decide '
                         'what level of tests to run. Supplying this multiple '
                         'times will increase the level accordingly. Defaults '
-                        'to %(default)d, the lowest (and fastest) level. Currently unused.')
+                        'to %(default)d, the lowest (and fastest) level. Level 1 '
+                        'adds integration tests and level 2 adds benchmarks, '
+                        'written as JSON to ./shippable/benchresults/.')
     parser.add_argument('-v', '--verbose', action='count', default=0, help='Verbose output. '
                         'Supplying this multiple times will increase verbosity. '
                         'This is usually unnecesary; the test suite will print '
@@ -62,6 +64,15 @@ def main(args=sys.argv):
         runner = unittest.TextTestRunner(verbosity=kwds['verbose'])
         result = runner.run(final_suite)
 
+    if kwds["level"] >= 2:
+        import bench_dpthree
+
+        bench_dir = os.path.join(topdir, 'shippable', 'benchresults')
+        if not os.path.isdir(bench_dir):
+            os.makedirs(bench_dir)
+        bench_dpthree.main([bench_dpthree.__file__, '--json',
+                            os.path.join(bench_dir, 'results.json')])
+
     return int(not result.wasSuccessful())
 
 
@@ -1,8 +1,10 @@
 """Test module for dpthree."""
 from __future__ import print_function, absolute_import
 
+import os
 import sys
 import warnings
+import functools
 
 import dpthree
 
@@ -63,6 +65,18 @@ class Test_dpthree(unittest.TestCase):
         with self.assertRaises(Warning):
             removed.unichr(6000)
 
+        with self.assertRaises(Warning):
+            removed.execfile(__file__, {})
+
+        with self.assertRaises(Warning):
+            removed.buffer(b'bytes')
+
+        with self.assertRaises(Warning):
+            removed.cmp(1, 2)
+
+        with self.assertRaises(Warning):
+            kludges.sorted_cmp([2, 1], lambda a, b: b - a)
+
         with self.assertRaises(Warning):
             kludges.bytechr(128)
 
@@ -79,6 +93,23 @@ class Test_dpthree(unittest.TestCase):
         for i in range(256):
             self.assertEqual(len(kludges.bytechr(i)), 1)
 
+        with self.assertRaises(ValueError):
+            kludges.bytechr(-1)
+
+        self.assertIs(kludges.bytechr(200), kludges.bytechr(200))
+
+    def test_bytechrs(self):
+        self.assertEqual(kludges.bytechrs([73, 79, 85]), b'IOU')
+        self.assertEqual(kludges.bytechrs(iter(range(256))),
+                         b''.join(kludges.bytechr(i) for i in range(256)))
+        self.assertIsInstance(kludges.bytechrs([]), bytes)
+
+        with self.assertRaises(ValueError):
+            kludges.bytechrs([256])
+
+        with self.assertRaises(TypeError):
+            kludges.bytechrs(3)  # should only accept iterables
+
     def test_basestring(self):
         with self.assertRaises(TypeError):
             removed.basestring()
@@ -112,6 +143,10 @@ class Test_dpthree(unittest.TestCase):
         self.assertEqual(removed.unicode.__name__, 'unicode')
         self.assertEqual(removed.unichr.__name__, 'unichr')
         self.assertEqual(removed.xrange.__name__, 'xrange')
+        self.assertEqual(removed.execfile.__name__, 'execfile')
+        self.assertEqual(removed.buffer.__name__, 'buffer')
+        self.assertEqual(removed.cmp.__name__, 'cmp')
+        self.assertEqual(kludges.sorted_cmp.__name__, 'sorted_cmp')
 
         self.assertEqual(builtins.bytes.__name__, 'bytes')
 
@@ -138,7 +173,7 @@ class Test_dpthree(unittest.TestCase):
 
         def test_names2(self):
             self.assertEqual(builtins.str.__name__, 'unicode')
-            self.assertEqual(builtins.range.__name__, 'xrange')
+            self.assertEqual(builtins.range.__name__, 'range')
             self.assertEqual(builtins.chr.__name__, 'unichr')
 
     if dpthree.PY3:
@@ -150,6 +185,562 @@ class Test_dpthree(unittest.TestCase):
     def tearDown(self):
         self.catcher.__exit__(None, None, None)
 
+class Test_warn_once(unittest.TestCase):
+    def call_sites(self, action, count=3):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter(action, DeprecationWarning)
+            for _ in range(count):
+                removed.reduce(lambda a, b: a + b, [1, 2, 3])
+                removed.xrange(10)
+        return caught
+
+    def test_default(self):
+        self.assertEqual(len(self.call_sites('default')), 2)
+
+    def test_always(self):
+        self.assertEqual(len(self.call_sites('always')), 6)
+
+    def test_error(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            for _ in range(3):
+                removed.unichr(65)
+
+            warnings.simplefilter('error', DeprecationWarning)
+            for _ in range(3):
+                with self.assertRaises(DeprecationWarning):
+                    removed.unichr(65)
+
+    def test_filename(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', DeprecationWarning)
+            removed.unicode(u'unicode')
+        filename = __file__[:-1] if __file__.endswith('.pyc') else __file__
+        self.assertEqual([w.filename for w in caught], [filename])
+
+
+class Test_production(unittest.TestCase):
+    def setUp(self):
+        self.production = dpthree._production
+        dpthree.configure(production=True)
+
+    def test_bindings(self):
+        self.assertIs(removed.reduce, functools.reduce)
+        self.assertIs(removed.unicode, builtins.str)
+        self.assertIs(removed.xrange, builtins.range)
+        self.assertIs(removed.unichr, builtins.chr)
+        self.assertIs(removed.raw_input, builtins.input)
+        self.assertIs(removed.execfile, dpthree._execfile)
+        self.assertIs(kludges.bytechr, dpthree.bytechr)
+        self.assertIs(kludges.bytestr, dpthree.bytestr)
+        self.assertIs(kludges.bytechrs, dpthree.bytechrs)
+        self.assertIs(kludges.sorted_cmp, dpthree.sorted_cmp)
+
+    def test_no_warnings(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            self.assertIsInstance(u'unicode string', removed.basestring)
+            self.assertIsInstance(b'byte string', removed.basestring)
+            self.assertNotIsInstance(1, removed.basestring)
+            with self.assertRaises(TypeError):
+                removed.basestring()
+
+            self.assertEqual(kludges.bytechr(65), b'A')
+
+    def test_reconfigure(self):
+        dpthree.configure(production=False)
+        self.assertIsNot(removed.reduce, functools.reduce)
+        self.assertEqual(removed.reduce.__name__, 'reduce')
+
+    def tearDown(self):
+        dpthree.configure(production=self.production)
+
+
+class Test_stats(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+        dpthree.stats(reset=True)
+
+    def test_counts(self):
+        for _ in range(3):
+            removed.unichr(65)
+        lineno = sys._getframe().f_lineno - 1
+        removed.xrange(10)
+
+        unichr_stat, xrange_stat = dpthree.stats()
+        self.assertEqual(unichr_stat.name, 'unichr')
+        self.assertEqual(unichr_stat.count, 3)
+        self.assertEqual(unichr_stat.lineno, lineno)
+        self.assertTrue(__file__.startswith(unichr_stat.filename))
+        self.assertEqual((xrange_stat.name, xrange_stat.count), ('xrange', 1))
+
+    def test_same_line(self):
+        removed.unicode(removed.unichr(65))
+        self.assertEqual(sorted(stat.name for stat in dpthree.stats()),
+                         ['unichr', 'unicode'])
+
+    def test_reset(self):
+        removed.unichr(65)
+        self.assertEqual(len(dpthree.stats(reset=True)), 1)
+        self.assertEqual(dpthree.stats(), [])
+
+    def test_eval(self):
+        # NOTE: every eval makes a new code object, so a new call site
+        for _ in range(dpthree._max_sites + 10):
+            eval('removed.unichr(65)')
+        self.assertLessEqual(len(dpthree._sites), dpthree._max_sites)
+        self.assertEqual([(stat.filename, stat.count) for stat in
+                          dpthree.stats(reset=True)],
+                         [('<string>', dpthree._max_sites + 10)])
+        self.assertEqual(len(dpthree._sites), 0)
+
+    def test_threads(self):
+        import threading
+
+        def work():
+            for _ in range(1000):
+                removed.unichr(65)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([stat.count for stat in dpthree.stats()], [4000])
+
+    def test_ended_threads(self):
+        import threading
+
+        def work():
+            removed.unichr(65)
+
+        for _ in range(100):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        # NOTE: only the tables of threads that are still running are kept
+        self.assertEqual([stat.count for stat in dpthree.stats()], [100])
+        self.assertLess(len(dpthree._stats_tables), 10)
+        self.assertEqual(dpthree.stats(reset=True)[0].count, 100)
+        self.assertEqual(dpthree.stats(), [])
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+
+
+class Test_sampling(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+        dpthree.stats(reset=True)
+        dpthree.samples(clear=True)
+
+    def test_every(self):
+        dpthree.set_sampling('unichr', every=10)
+        for _ in range(25):
+            removed.unichr(65)
+
+        self.assertEqual([stat.count for stat in dpthree.stats()], [3])
+        samples = dpthree.samples()
+        self.assertEqual([sample.name for sample in samples], ['unichr'] * 3)
+        self.assertEqual(samples[0].stack[-1][2], 'test_every')
+
+    def test_rate(self):
+        dpthree.set_sampling('unichr', rate=1e-6, burst=2)
+        for _ in range(25):
+            removed.unichr(65)
+
+        self.assertEqual(len(dpthree.samples()), 2)
+
+    def test_other_names(self):
+        dpthree.set_sampling('unichr', every=1000)
+        removed.unichr(65)
+        removed.unichr(65)
+        removed.xrange(1)
+        self.assertEqual(sorted((stat.name, stat.count) for stat in dpthree.stats()),
+                         [('unichr', 1), ('xrange', 1)])
+        self.assertEqual(len(dpthree.samples()), 1)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            dpthree.set_sampling('unichr', every=10, rate=10)
+
+        with self.assertRaises(ValueError):
+            dpthree.set_sampling('unichr', every=0)
+
+        with self.assertRaises(ValueError):
+            dpthree.set_sampling('unichr', rate=0)
+
+    def tearDown(self):
+        dpthree.set_sampling('unichr')
+        self.catcher.__exit__(None, None, None)
+
+
+class Test_quiet(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('error', DeprecationWarning)
+
+    def test_quiet(self):
+        with dpthree.quiet():
+            removed.unichr(65)
+            removed.xrange(10)
+            self.assertIsInstance(u'unicode string', removed.basestring)
+
+        with self.assertRaises(DeprecationWarning):
+            removed.unichr(65)
+
+    def test_nested(self):
+        with dpthree.quiet():
+            with dpthree.quiet():
+                removed.unichr(65)
+            removed.unichr(65)
+
+        with self.assertRaises(DeprecationWarning):
+            removed.unichr(65)
+
+    def test_threads(self):
+        import threading
+        errors = []
+
+        def work():
+            try:
+                removed.unichr(65)
+            except DeprecationWarning as e:
+                errors.append(e)
+
+        with dpthree.quiet():
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(errors), 1)
+
+    @unittest.skipIf(dpthree.contextvars is None, 'needs contextvars')
+    def test_contexts(self):
+        # NOTE: each asyncio task runs in its own copy of the context
+        context = dpthree.contextvars.copy_context()
+        with dpthree.quiet():
+            context.run(self.assertRaises, DeprecationWarning,
+                        removed.unichr, 65)
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+
+
+class Test_lazy(unittest.TestCase):
+    def test_built_once(self):
+        calls = []
+
+        def factory():
+            calls.append(None)
+            return object()
+
+        mod = dpthree._lazy_module('lazy', 'doc', {'thing': factory})
+        self.assertEqual(calls, [])
+        self.assertIs(mod.thing, mod.thing)
+        self.assertEqual(len(calls), 1)
+        self.assertIn('thing', dir(mod))
+        self.assertEqual(mod.__all__, ('thing',))
+        with self.assertRaises(AttributeError):
+            mod.other
+
+    def test_import(self):
+        import subprocess
+        code = ('import dpthree; '
+                'print(sorted(n for n in vars(dpthree.removed) '
+                'if not n.startswith("_")))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_star_import(self):
+        for mod in (removed, kludges):
+            namespace = {}
+            exec('from dpthree.%s import *' % mod.__name__, namespace)
+            self.assertTrue(set(mod.__all__) <= set(namespace))
+
+        self.assertIn('reduce', dir(removed))
+        self.assertIn('bytechr', kludges.__all__)
+
+    if dpthree.PY2:
+        def test_builtins_all(self):
+            for name in ('int', 'bytes', 'str', 'range', 'compile', 'open'):
+                self.assertIn(name, builtins.__all__)
+
+
+class Test_renamed_modules(unittest.TestCase):
+    def test_not_imported(self):
+        import subprocess
+        code = ('import sys, dpthree; '
+                'print(sorted(n for n in ("SocketServer", "socketserver", '
+                '"Tkinter", "tkinter", "_tkinter") if n in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_import(self):
+        import dpthree.modules.socketserver
+        real = __import__('SocketServer' if dpthree.PY2 else 'socketserver')
+        self.assertIs(dpthree.modules.socketserver, real)
+        self.assertIs(modules.socketserver, real)
+        self.assertIs(sys.modules['dpthree.modules.socketserver'], real)
+        if dpthree.PY3:
+            self.assertEqual(real.__spec__.name, 'socketserver')
+
+    def test_attribute(self):
+        self.assertIs(modules.copyreg,
+                      __import__('copy_reg' if dpthree.PY2 else 'copyreg'))
+        self.assertIn('reprlib', dir(modules))
+        self.assertFalse(hasattr(modules, 'not_renamed'))
+
+    def test_tkinter_submodules(self):
+        import subprocess
+        code = ('import sys, dpthree.modules.tkinter; '
+                'print(sorted(n for n in ("tkFont", "tkinter.font", '
+                '"dpthree.modules.tkinter.font") if n in sys.modules)); '
+                'import dpthree.modules.tkinter.font as font; '
+                'print(font.__name__)')
+        try:
+            output = subprocess.check_output([sys.executable, '-c', code])
+        except subprocess.CalledProcessError:
+            self.skipTest('tkinter is not available')
+
+        loaded, name = output.split()
+        self.assertEqual(loaded, b'[]')
+        self.assertEqual(name, b'tkFont' if dpthree.PY2 else b'tkinter.font')
+
+    def test_loadnewnames(self):
+        import threading
+        module_table = sys.modules
+        errors = []
+
+        def work():
+            try:
+                dpthree.loadnewnames()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertIs(sys.modules, module_table)
+        if dpthree.PY2:
+            import Queue
+            self.assertIs(sys.modules['queue'], Queue)
+
+    def test_preload(self):
+        for parallel in (True, False):
+            report = dpthree.preload(['queue', 'reprlib', 'winreg'],
+                                     parallel=parallel, freeze=False)
+            self.assertEqual(report.loaded, ('dpthree.modules.queue',
+                                             'dpthree.modules.reprlib'))
+            self.assertEqual(report.failed, () if sys.platform == 'win32'
+                             else ('dpthree.modules.winreg',))
+            self.assertFalse(report.frozen)
+            self.assertGreaterEqual(report.seconds, 0)
+        self.assertIs(modules.queue,
+                      sys.modules['Queue' if dpthree.PY2 else 'queue'])
+        self.assertIn('unichr', vars(dpthree.removed))
+        self.assertIn('bytechr', vars(dpthree.kludges))
+
+    def test_preload_tkinter(self):
+        import subprocess
+        code = ('import sys, dpthree; report = dpthree.preload(freeze=False); '
+                'print("%s %s" % (any("tkinter" in name for name in '
+                'report.loaded + report.failed), "_tkinter" in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.split(), [b'False', b'False'])
+
+    def test_preload_freeze(self):
+        import subprocess
+        code = ('import gc, dpthree; report = dpthree.preload(); '
+                'print("%s %s" % (report.frozen, gc.get_freeze_count() > 0 '
+                'if report.frozen else True))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        frozen, counted = output.split()
+        self.assertEqual(frozen, str(sys.version_info >= (3, 7)).encode())
+        self.assertEqual(counted, b'True')
+
+    def test_preload_while_importing(self):
+        import time
+        import shutil
+        import tempfile
+        import subprocess
+        # NOTE: prefork servers preload like this, in the module they import
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, 'app_mod.py'), 'w') as app:
+                app.write('import dpthree\nreport = dpthree.preload()\n')
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+                [tmpdir, os.path.dirname(os.path.abspath(dpthree.__file__))]))
+            child = subprocess.Popen([sys.executable, '-c', 'import app_mod'],
+                                     env=env)
+            deadline = time.time() + 60
+            while child.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if child.poll() is None:
+                child.kill()
+                child.wait()
+                self.fail('preload hung while its module was being imported')
+            self.assertEqual(child.returncode, 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    if dpthree.PY2:
+        def test_top_level(self):
+            import queue
+            import Queue
+            self.assertIs(queue, Queue)
+
+
+class Test_removed_types(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings(record=True)
+        self.caught = self.catcher.__enter__()
+        warnings.simplefilter('always', DeprecationWarning)
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+
+    def test_isinstance(self):
+        self.assertIsInstance(u'unicode string', removed.unicode)
+        self.assertNotIsInstance(b'byte string' if dpthree.PY3 else 1,
+                                 removed.unicode)
+        self.assertIsInstance(b'byte string', removed.basestring)
+        self.assertNotIsInstance(1, removed.basestring)
+        self.assertTrue(issubclass(builtins.str, removed.basestring))
+        self.assertFalse(issubclass(int, removed.xrange))
+
+    def test_warnings(self):
+        isinstance(u'unicode string', removed.unicode)
+        issubclass(builtins.str, removed.unicode)
+        self.assertEqual(len(self.caught), 2)
+        filename = __file__[:-1] if __file__.endswith('.pyc') else __file__
+        self.assertEqual(set(w.filename for w in self.caught), set([filename]))
+
+    def test_warned_sites(self):
+        def check():
+            return isinstance(u'unicode string', removed.basestring)
+
+        warnings.simplefilter('default', DeprecationWarning)
+        for _ in range(3):
+            check()
+        self.assertEqual(len(self.caught), 1)
+
+        # NOTE: a site that has warned checks again when the filters change,
+        # though on Python 2 the registry would still stop the warning
+        globals().pop('__warningregistry__', None)
+        warnings.simplefilter('error', DeprecationWarning)
+        with self.assertRaises(DeprecationWarning):
+            check()
+
+    def test_counted_checks(self):
+        def check():
+            return isinstance(u'unicode string', removed.basestring)
+
+        def check_subclass():
+            return issubclass(bytes, removed.basestring)
+
+        warnings.simplefilter('default', DeprecationWarning)
+        dpthree.stats(reset=True)
+        for _ in range(10):
+            check()
+            check_subclass()
+        counts = [stat.count for stat in dpthree.stats(reset=True)
+                  if stat.name == 'basestring']
+        self.assertEqual(counts, [10, 10])
+
+        dpthree.set_sampling('basestring', every=5)
+        try:
+            dpthree.samples(clear=True)
+            for _ in range(10):
+                check()
+            self.assertEqual(len(dpthree.samples(clear=True)), 2)
+        finally:
+            dpthree.set_sampling('basestring')
+
+    def test_dynamic_classes(self):
+        classes = [type('dynamic%d' % i, (object,), {}) for i in range(100)]
+        for cls in classes:
+            self.assertFalse(issubclass(cls, removed.basestring))
+            self.assertNotIsInstance(cls(), removed.basestring)
+        self.assertNotIn('_abc_negative_cache', vars(removed.basestring))
+        self.assertNotIn('_abc_impl', vars(removed.basestring))
+
+
+class Test_range(unittest.TestCase):
+    def test_construction(self):
+        self.assertEqual(list(builtins.range(3)), [0, 1, 2])
+        self.assertEqual(list(builtins.range(1, 7, 2)), [1, 3, 5])
+        self.assertEqual(list(builtins.range(3, 0, -1)), [3, 2, 1])
+        self.assertEqual(repr(builtins.range(1, 7, 2)), 'range(1, 7, 2)')
+        r = builtins.range(1, 7, 2)
+        self.assertEqual((r.start, r.stop, r.step), (1, 7, 2))
+
+        with self.assertRaises(ValueError):
+            builtins.range(1, 2, 0)
+        with self.assertRaises(TypeError):
+            builtins.range(1.0)
+
+    def test_big(self):
+        r = builtins.range(10 ** 20, 8 * 10 ** 20, 7)
+        self.assertEqual(r[0], 10 ** 20)
+        self.assertEqual(r[-1], 8 * 10 ** 20 - 7)
+        self.assertIn(10 ** 20 + 70, r)
+        self.assertNotIn(10 ** 20 + 71, r)
+        self.assertEqual(r.index(10 ** 20 + 70), 10)
+        self.assertEqual(r.count(10 ** 20 + 70), 1)
+        self.assertEqual(list(r[:2]), [10 ** 20, 10 ** 20 + 7])
+        with self.assertRaises(OverflowError):
+            len(r)
+
+    def test_membership(self):
+        r = builtins.range(0, 10 ** 12, 3)
+        self.assertIn(3 * 10 ** 10, r)
+        self.assertNotIn(3 * 10 ** 10 + 1, r)
+        self.assertNotIn(-3, r)
+        self.assertIn(3.0, builtins.range(5))  # compared one by one
+        self.assertEqual(builtins.range(5).count(3.0), 1)
+        with self.assertRaises(ValueError):
+            r.index(1)
+
+    def test_slicing(self):
+        r = builtins.range(0, 20, 3)
+        for index in (slice(None), slice(2, 5), slice(-3, None),
+                      slice(None, None, -2), slice(10, -10, -1),
+                      slice(100, 200)):
+            self.assertEqual(r[index], builtins.range(0, 20, 3)[index])
+            self.assertEqual(list(r[index]), list(r)[index])
+            self.assertIsInstance(r[index], builtins.range)
+        with self.assertRaises(IndexError):
+            r[7]
+
+    def test_equality(self):
+        self.assertEqual(builtins.range(0, 10), builtins.range(0, 10, 1))
+        self.assertEqual(builtins.range(0), builtins.range(5, 2))
+        self.assertEqual(builtins.range(1, 2), builtins.range(1, 5, 5))
+        self.assertNotEqual(builtins.range(0, 5), builtins.range(0, 6))
+        self.assertEqual(hash(builtins.range(0, 3, 2)),
+                         hash(builtins.range(0, 4, 2)))
+        self.assertNotEqual(builtins.range(3), [0, 1, 2])
+
+    def test_removed_xrange(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            r = removed.xrange(10 ** 20)
+        self.assertIsInstance(r, builtins.range)
+        self.assertIn(10 ** 19, r)
+
+
 class Test_bytes(unittest.TestCase):
     def setUp(self):
         self.bytes_obj = builtins.bytes(b'I am a bytes object.')
@@ -157,10 +748,599 @@ class Test_bytes(unittest.TestCase):
     def test_construction(self):
         self.assertEqual(builtins.bytes([73, 79, 85]), builtins.bytes(b'IOU'))
 
+    def test_construction_bulk(self):
+        import array
+        import mmap
+        source = mmap.mmap(-1, 3)
+        source.write(b'IOU')
+        for source in (bytearray(b'IOU'), memoryview(b'IOU'), source,
+                       array.array('B', [73, 79, 85]), iter([73, 79, 85])):
+            result = builtins.bytes(source)
+            self.assertIsInstance(result, builtins.bytes)
+            self.assertEqual(result, b'IOU')
+
+        with self.assertRaises(ValueError):
+            builtins.bytes([256])
+        with self.assertRaises(TypeError):
+            builtins.bytes([None])
+
     def test_indexing(self):
         self.assertIsInstance(self.bytes_obj[0:1], builtins.bytes)
         self.assertIsInstance(self.bytes_obj[0], builtins.int)
 
+    def test_iteration(self):
+        self.assertEqual(list(self.bytes_obj),
+                         [self.bytes_obj[i] for i in range(len(self.bytes_obj))])
+        self.assertEqual(list(builtins.bytes()), [])
+
+    def test_hex(self):
+        self.assertEqual(builtins.bytes(b'\x00\xffab').hex(), u'00ff6162')
+        self.assertIsInstance(builtins.bytes().hex(), builtins.str)
+
+        result = builtins.bytes.fromhex(u' 00ff 61  62 ')
+        self.assertIsInstance(result, builtins.bytes)
+        self.assertEqual(result, b'\x00\xffab')
+
+        # NOTE: whitespace is only skipped between pairs
+        for bad in (u'0', u'zz', u'a b', u'0 0ff', u'00\xa0ff'):
+            with self.assertRaises(ValueError):
+                builtins.bytes.fromhex(bad)
+        with self.assertRaises(TypeError):
+            builtins.bytes.fromhex(5)
+
+
+class Test_bytestr(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.bytestr = kludges.bytestr(b'I am a bytestr.')
+
+    def test_type(self):
+        self.assertIsInstance(self.bytestr, bytes)
+        self.assertIsInstance(self.bytestr, kludges.bytestr)
+        self.assertEqual(self.bytestr, b'I am a bytestr.')
+
+    def test_indexing(self):
+        self.assertEqual(self.bytestr[0], b'I')
+        self.assertEqual(self.bytestr[-1], b'.')
+        self.assertIs(self.bytestr[2], self.bytestr[5])
+        self.assertIsInstance(self.bytestr[0:4], dpthree.bytestr)
+        self.assertEqual(self.bytestr[0:4][2], b'a')
+        with self.assertRaises(IndexError):
+            self.bytestr[100]
+
+    def test_iteration(self):
+        self.assertEqual(list(self.bytestr),
+                         [self.bytestr[i] for i in range(len(self.bytestr))])
+        self.assertEqual(b''.join(self.bytestr), self.bytestr)
+
+
+class Test_int(unittest.TestCase):
+    if dpthree.PY2:
+        def test_isinstance(self):
+            class subint(builtins.int):
+                pass
+
+            for value in (5, long(5), True, builtins.int(5), subint(5)):
+                self.assertIsInstance(value, builtins.int)
+            self.assertNotIsInstance(5.0, builtins.int)
+            self.assertIsInstance(subint(5), subint)
+            self.assertNotIsInstance(5, subint)
+
+            self.assertTrue(issubclass(bool, builtins.int))
+            self.assertTrue(issubclass(subint, builtins.int))
+            self.assertFalse(issubclass(long, subint))
+
+            self.assertIsInstance(b'bytes', builtins.bytes)
+            self.assertNotIsInstance(u'unicode', builtins.bytes)
+            self.assertFalse(issubclass(bytearray, builtins.bytes))
+
+        def test_fast_path(self):
+            for x, value in ((5, 5), (-5.7, -5), (2 ** 70, 2 ** 70)):
+                result = builtins.int(x)
+                self.assertIs(type(result), builtins.int)
+                self.assertEqual(result, value)
+
+        def test_small_ints(self):
+            dpthree.configure(small_ints=True)
+            try:
+                for x in (5, 5.5, '5', builtins.int(5)):
+                    result = builtins.int(x)
+                    self.assertIs(type(result), int)
+                    self.assertIsInstance(result, builtins.int)
+                    self.assertEqual(result, 5)
+
+                self.assertIs(type(builtins.int(2 ** 70)), builtins.int)
+                self.assertIs(type(builtins.int('9' * 30)), builtins.int)
+                with self.assertRaises(ValueError):
+                    builtins.int('1L')
+
+                class subint(builtins.int):
+                    pass
+                self.assertIs(type(subint(5)), subint)
+
+                with self.assertRaises(AttributeError):
+                    builtins.int(5).to_bytes
+                self.assertEqual(builtins.int.to_bytes(5, 2, 'big'), b'\0\5')
+                self.assertEqual(builtins.int.to_bytes(5, 3, 'big'),
+                                 b'\0\0\5')
+                result = builtins.int.from_bytes(b'\5', 'big')
+                self.assertIs(type(result), builtins.int)
+                self.assertEqual(result.to_bytes(1, 'big'), b'\5')
+            finally:
+                dpthree.configure(small_ints=False)
+
+            self.assertIs(type(builtins.int(5)), builtins.int)
+
+    def test_to_bytes(self):
+        self.assertEqual(builtins.int(1).to_bytes(2, 'big'), b'\x00\x01')
+        self.assertEqual(builtins.int(1).to_bytes(2, 'little'), b'\x01\x00')
+        self.assertEqual(builtins.int(-2).to_bytes(3, 'big', signed=True),
+                         b'\xff\xff\xfe')
+        self.assertEqual(builtins.int(2 ** 64).to_bytes(9, 'big'),
+                         b'\x01' + b'\x00' * 8)
+        self.assertEqual(builtins.int(0).to_bytes(0, 'big'), b'')
+        self.assertEqual(builtins.int(-1).to_bytes(0, 'big', signed=True),
+                         b'')
+        self.assertEqual(builtins.int(-128).to_bytes(1, 'big', signed=True),
+                         b'\x80')
+        self.assertIsInstance(builtins.int(0).to_bytes(1, 'big'),
+                              builtins.bytes)
+
+        with self.assertRaises(OverflowError):
+            builtins.int(256).to_bytes(1, 'big')
+        with self.assertRaises(OverflowError):
+            builtins.int(128).to_bytes(1, 'big', signed=True)
+        with self.assertRaises(OverflowError):
+            builtins.int(-1).to_bytes(1, 'big')
+        for value in (1, -2):
+            with self.assertRaises(OverflowError):
+                builtins.int(value).to_bytes(0, 'big', signed=True)
+        with self.assertRaises(ValueError):
+            builtins.int(1).to_bytes(1, 'middle')
+
+    def test_from_bytes(self):
+        self.assertEqual(builtins.int.from_bytes(b'\x00\x01', 'big'), 1)
+        self.assertEqual(builtins.int.from_bytes([1, 0], 'little'), 1)
+        self.assertEqual(builtins.int.from_bytes(b'\xff\xfe', 'big',
+                                                 signed=True), -2)
+        self.assertEqual(builtins.int.from_bytes(b'\xff\xfe', 'big'), 65534)
+        self.assertEqual(builtins.int.from_bytes(b'', 'big'), 0)
+        self.assertIsInstance(builtins.int.from_bytes(b'\x01', 'big'),
+                              builtins.int)
+
+    def test_round_trip(self):
+        for value in (0, 1, -1, 255, -256, 2 ** 63 - 1, -2 ** 63, 2 ** 80 + 5):
+            for length in (11, 16):
+                for byteorder in ('big', 'little'):
+                    data = builtins.int(value).to_bytes(length, byteorder,
+                                                        signed=True)
+                    self.assertEqual(len(data), length)
+                    self.assertEqual(builtins.int.from_bytes(
+                        data, byteorder, signed=True), value)
+
+
+class Test_decimal_strings(unittest.TestCase):
+    def setUp(self):
+        # NOTE: the native conversions are only here to check against
+        self.max_str_digits = getattr(sys, 'get_int_max_str_digits', None)
+        if self.max_str_digits is not None:
+            self.max_str_digits = sys.get_int_max_str_digits()
+            sys.set_int_max_str_digits(0)
+
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+        if self.max_str_digits is not None:
+            sys.set_int_max_str_digits(self.max_str_digits)
+
+    def values(self):
+        for exponent in (0, 1, 3000, 3001, 12345, 40000):
+            yield 7 ** exponent
+            yield -(10 ** exponent)
+
+    def test_int2str(self):
+        for value in self.values():
+            self.assertEqual(kludges.int2str(value), str(value))
+
+        with self.assertRaises(TypeError):
+            kludges.int2str(1.5)
+
+    def test_str2int(self):
+        for value in self.values():
+            text = str(value)
+            self.assertEqual(kludges.str2int(text), value)
+            self.assertEqual(kludges.str2int(' +%s\n' % text.lstrip('-')),
+                             abs(value))
+            self.assertEqual(kludges.str2int(text.encode('ascii')), value)
+
+        for text in ('', '12a', '1' * 5000 + 'a', '--' + '1' * 5000):
+            with self.assertRaises(ValueError):
+                kludges.str2int(text)
+
+    if dpthree.PY2:
+        def test_builtin_int(self):
+            for value in self.values():
+                result = builtins.int(str(value))
+                self.assertIs(type(result), builtins.int)
+                self.assertEqual(result, value)
+
+            with self.assertRaises(ValueError):
+                builtins.int('1' * 5000 + 'L')
+
+
+class Test_compile_cache(unittest.TestCase):
+    def setUp(self):
+        dpthree.configure(compile_cache=4)
+        builtins.compile.cache_clear()
+
+    def tearDown(self):
+        # NOTE: the cache is only on by default on Python 2
+        dpthree.configure(compile_cache=128 if dpthree.PY2 else 0)
+
+    def test_hits(self):
+        first = builtins.compile('x + 1', '<test>', 'eval')
+        self.assertIs(builtins.compile('x + 1', '<test>', 'eval'), first)
+        self.assertEqual(eval(first, {'x': 1}), 2)
+        self.assertEqual(builtins.compile.cache_info(),
+                         dpthree.CompileCacheInfo(1, 1, 4, 1))
+
+        self.assertIsNot(builtins.compile('x + 1', '<other>', 'eval'), first)
+        self.assertIsNot(builtins.compile('x + 1', '<test>', 'single'), first)
+        self.assertEqual(builtins.compile.cache_info().misses, 3)
+
+    def test_buffers(self):
+        source = b'x = 2\n'
+        first = builtins.compile(memoryview(source), '<test>', 'exec')
+        self.assertIs(builtins.compile(bytearray(source), '<test>', 'exec'),
+                      first)
+        namespace = {}
+        exec(first, namespace)
+        self.assertEqual(namespace['x'], 2)
+
+    def test_lru(self):
+        codes = [builtins.compile(str(n), '<test>', 'eval') for n in range(5)]
+        self.assertEqual(builtins.compile.cache_info().currsize, 4)
+        self.assertIs(builtins.compile('4', '<test>', 'eval'), codes[4])
+        self.assertIsNot(builtins.compile('0', '<test>', 'eval'), codes[0])
+
+        builtins.compile.cache_clear()
+        self.assertEqual(builtins.compile.cache_info(),
+                         dpthree.CompileCacheInfo(0, 0, 4, 0))
+
+    def future_result(self, source, feature=None, dont_inherit=False):
+        caller = 'code = builtins.compile(source, "<test>", "exec", 0, %r)'
+        caller %= dont_inherit
+        if feature:
+            caller = 'from __future__ import %s\n%s' % (feature, caller)
+        namespace = dict(builtins=builtins, source=source, y=1)
+        exec(dpthree._native_compile(caller, '<caller>', 'exec', 0, True),
+             namespace)
+        exec(namespace['code'], namespace)
+        return namespace['result']
+
+    def test_future_flags(self):
+        if dpthree.PY2:
+            feature, source, results = 'division', 'result = 1 / 2', (0.5, 0)
+        elif sys.version_info >= (3, 7):
+            feature, results = 'annotations', ('y', 1)
+            source = 'def f(x: y): pass\nresult = f.__annotations__["x"]'
+        else:
+            self.skipTest('no optional __future__ feature to inherit')
+
+        self.assertEqual(self.future_result(source, feature), results[0])
+        self.assertEqual(self.future_result(source), results[1])
+        self.assertEqual(self.future_result(source, feature, True), results[1])
+        self.assertEqual(builtins.compile.cache_info(),
+                         dpthree.CompileCacheInfo(1, 2, 4, 2))
+
+    def test_uncached(self):
+        import ast
+        tree = builtins.compile('1', '<test>', 'eval', ast.PyCF_ONLY_AST)
+        self.assertIsInstance(tree, ast.Expression)
+        builtins.compile(tree, '<test>', 'eval')
+        self.assertEqual(builtins.compile.cache_info().currsize, 0)
+
+        dpthree.configure(compile_cache=0)
+        builtins.compile('1', '<test>', 'eval')
+        self.assertEqual(dpthree._compile_cache.cache_info().misses, 0)
+        if not dpthree.PY2:
+            self.assertIs(builtins.compile, dpthree._native_compile)
+
+        with self.assertRaises(SyntaxError):
+            builtins.compile('1 +', '<test>', 'eval')
+
+
+class Test_execfile(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'script.py')
+        self.write('x = y * 2\n')
+
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+
+    def tearDown(self):
+        import shutil
+        self.catcher.__exit__(None, None, None)
+        shutil.rmtree(self.directory)
+
+    def write(self, source, mtime=None):
+        with open(self.path, 'w') as script:
+            script.write(source)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_namespaces(self):
+        namespace = {'y': 3}
+        removed.execfile(self.path, namespace)
+        self.assertEqual(namespace['x'], 6)
+
+        local = {'y': 4}
+        removed.execfile(self.path, namespace, local)
+        self.assertEqual((namespace['x'], local['x']), (6, 8))
+
+    def test_caller_globals(self):
+        global y
+        y = 5
+        # NOTE: otherwise x goes to the locals of this function
+        self.write('global x\nx = y * 2\n')
+        try:
+            removed.execfile(self.path)
+            self.assertEqual(globals().pop('x'), 10)
+
+            dpthree.configure(production=True)
+            removed.execfile(self.path)
+            self.assertEqual(globals().pop('x'), 10)
+        finally:
+            dpthree.configure(production=False)
+            del y
+
+    def cached_codes(self):
+        return [code for (path, _), (_, code)
+                in dpthree._execfile_codes.items() if path == self.path]
+
+    def test_cache(self):
+        removed.execfile(self.path, {'y': 1})
+        codes = self.cached_codes()
+        removed.execfile(self.path, {'y': 1})
+        self.assertEqual(len(codes), 1)
+        self.assertIs(self.cached_codes()[0], codes[0])
+
+        # NOTE: same size, so only the modification time gives it away
+        self.write('x = y * 3\n', mtime=1234567890)
+        namespace = {'y': 1}
+        removed.execfile(self.path, namespace)
+        self.assertEqual(namespace['x'], 3)
+
+        self.write('x = y * 40\n', mtime=1234567890)
+        removed.execfile(self.path, namespace)
+        self.assertEqual(namespace['x'], 40)
+
+        with self.assertRaises(SyntaxError):
+            self.write('x = \n')
+            removed.execfile(self.path, namespace)
+
+    def test_future_flags(self):
+        if dpthree.PY2:
+            feature, results = 'division', (0.5, 0)
+            self.write('x = 1 / 2\n')
+        elif sys.version_info >= (3, 7):
+            feature, results = 'annotations', ('y', 1)
+            self.write('def f(a: y): pass\nx = f.__annotations__["a"]\n')
+        else:
+            self.skipTest('no optional __future__ feature to inherit')
+
+        caller = 'removed.execfile(path, namespace)'
+        for source, result in (('from __future__ import %s\n%s' %
+                                (feature, caller), results[0]),
+                               (caller, results[1])):
+            namespace = {'y': 1}
+            code = dpthree._native_compile(source, '<caller>', 'exec', 0, True)
+            exec(code, dict(removed=removed, path=self.path,
+                            namespace=namespace))
+            self.assertEqual(namespace['x'], result)
+        self.assertEqual(len(self.cached_codes()), 2)
+
+    def test_bounded(self):
+        dpthree._max_execfile_codes, old = 2, dpthree._max_execfile_codes
+        try:
+            for n in range(5):
+                self.path = os.path.join(self.directory, 'script%d.py' % n)
+                self.write('x = y * 2\n')
+                removed.execfile(self.path, {'y': 1})
+            self.assertLessEqual(len(dpthree._execfile_codes), 2)
+        finally:
+            dpthree._max_execfile_codes = old
+
+    def test_relative_paths(self):
+        other = os.path.join(self.directory, 'other')
+        os.mkdir(other)
+        self.write('x = y * 2\n', mtime=1234567890)
+        self.path = os.path.join(other, 'script.py')
+        self.write('x = y * 5\n', mtime=1234567890)
+
+        cwd = os.getcwd()
+        try:
+            results = []
+            for directory in (self.directory, other, self.directory):
+                os.chdir(directory)
+                namespace = {'y': 1}
+                removed.execfile('script.py', namespace)
+                results.append(namespace['x'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(results, [2, 5, 2])
+
+
+class Test_buffer(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+
+    def test_views(self):
+        data = bytearray(b'hello world')
+        view = removed.buffer(data, 6)
+        self.assertIsInstance(view, removed.buffer)
+        self.assertEqual(bytes(view), b'world')
+        self.assertEqual(bytes(removed.buffer(data, 2, 3)), b'llo')
+        self.assertEqual(bytes(removed.buffer(data, 20)), b'')
+        self.assertEqual(bytes(removed.buffer(data, 6, 100)), b'world')
+
+        with self.assertRaises(TypeError):
+            view[0] = b'w'[0] if dpthree.PY3 else b'w'
+        self.assertEqual(data, bytearray(b'hello world'))
+
+        # NOTE: a view, not a copy, except of writable objects before 3.8
+        data[6:] = b'WORLD'
+        if dpthree.PY2 or hasattr(view, 'toreadonly'):
+            self.assertEqual(bytes(view), b'WORLD')
+            self.assertEqual(bytes(view[1:3]), b'OR')
+        else:
+            self.assertEqual(bytes(view), b'world')
+
+    def test_types(self):
+        import array
+        import mmap
+        self.assertEqual(bytes(removed.buffer(b'bytes', 1, 3)), b'yte')
+
+        numbers = array.array('i', [1, 2])
+        self.assertEqual(len(removed.buffer(numbers)), numbers.itemsize * 2)
+
+        mapped = mmap.mmap(-1, 16)
+        mapped[:4] = b'mmap'
+        view = removed.buffer(mapped, 1, 2)
+        self.assertEqual(bytes(view), b'ma')
+        del view
+        mapped.close()
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            removed.buffer(b'bytes', -1)
+        with self.assertRaises(ValueError):
+            removed.buffer(b'bytes', 0, -2)
+        with self.assertRaises(TypeError):
+            removed.buffer(1)
+
+
+class Test_sorted_cmp(unittest.TestCase):
+    def setUp(self):
+        self.catcher = warnings.catch_warnings()
+        self.catcher.__enter__()
+        warnings.simplefilter('ignore', DeprecationWarning)
+
+        import random
+        import collections
+        Record = collections.namedtuple('Record', 'x y')
+        shuffled = random.Random(42)
+        self.records = [Record(shuffled.randint(0, 9), shuffled.random())
+                        for _ in range(200)]
+
+    def tearDown(self):
+        self.catcher.__exit__(None, None, None)
+
+    def check(self, cmp, by_key, **kwargs):
+        expected = sorted(self.records, key=functools.cmp_to_key(cmp),
+                          **kwargs)
+        self.assertEqual(kludges.sorted_cmp(self.records, cmp, **kwargs),
+                         expected)
+        self.assertEqual(dpthree._cmp_key(cmp) is not None, by_key)
+
+    def test_cmp(self):
+        self.assertEqual(removed.cmp(1, 2), -1)
+        self.assertEqual(removed.cmp(2, 2), 0)
+        self.assertEqual(removed.cmp('b', 'a'), 1)
+
+    def test_by_key(self):
+        cmp = removed.cmp
+        self.check(cmp, True)
+        # NOTE: before Python 3.11, a lambda is only cut from its source
+        # lines when nothing but closing brackets and commas follow it
+        by_x = lambda a, b: cmp(a.x, b.x)
+        self.check(by_x, True)
+        by_x_descending = lambda a, b: cmp(b.x, a.x)
+        self.check(by_x_descending, True)
+        self.check(by_x_descending, True, reverse=True)
+        by_x_then_y = lambda a, b: cmp(a[0], b[0]) or cmp(a.y, b.y)
+        self.check(by_x_then_y, True)
+
+        def by_y(first, second):
+            """Compare records by y."""
+            return cmp(first.y, second.y)
+        self.check(by_y, True)
+
+    def test_by_cmp(self):
+        cmp = removed.cmp
+        self.check(lambda a, b: a.x - b.x, False)
+        self.check(lambda a, b: cmp(a.x, b.y), False)
+        self.check(lambda a, b: cmp(a.x, b.x) or cmp(b.y, a.y), False)
+        self.check(lambda a, b: cmp(a.x + 1, b.x + 1), False)
+
+        # NOTE: this once got cut down to just comparing x, which parses too
+        self.check(lambda a, b: cmp(a.x, b.x) or
+                   a.y - b.y, False)
+        by_xy = (lambda a, b: cmp(a.x, b.x) or
+                 cmp(a.y, b.y))
+        self.assertEqual(kludges.sorted_cmp(self.records, by_xy),
+                         sorted(self.records, key=functools.cmp_to_key(by_xy)))
+
+        # NOTE: not the builtin cmp, however it is called
+        cmp = lambda x, y: cmp_calls.append(x) or removed.cmp(y, x)
+        cmp_calls = []
+        self.check(lambda a, b: cmp(a.x, b.x), False)
+        self.assertTrue(cmp_calls)
+
+    def test_edited_source(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'edited.py')
+            source = 'by_first = lambda a, b: cmp(a[0], b[0])\n'
+            with open(path, 'w') as module:
+                module.write(source)
+            namespace = {'cmp': removed.cmp}
+            exec(compile(source, path, 'exec'), namespace)
+
+            # NOTE: the function running still compares the first items
+            with open(path, 'w') as module:
+                module.write(source.replace('0', '1'))
+            os.utime(path, (1234567890, 1234567890))
+            self.check(namespace['by_first'], False)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_bounded(self):
+        cmp = removed.cmp
+        by_x = lambda a, b: cmp(a.x, b.x)
+        by_y = lambda a, b: cmp(a.y, b.y)
+        by_x_descending = lambda a, b: cmp(b.x, a.x)
+        dpthree._max_cmp_terms, old = 2, dpthree._max_cmp_terms
+        try:
+            for by in (by_x, by_y, by_x_descending):
+                self.check(by, True)
+            self.assertEqual(list(dpthree._cmp_terms)[-2:],
+                             [by_y.__code__, by_x_descending.__code__])
+            self.assertEqual(len(dpthree._cmp_terms), 2)
+        finally:
+            dpthree._max_cmp_terms = old
+
+    def test_key(self):
+        self.assertEqual(kludges.sorted_cmp([3, 1, 2], removed.cmp,
+                                            key=lambda v: -v), [3, 2, 1])
+        self.assertEqual(kludges.sorted_cmp(['bb', 'a', 'ccc'],
+                                            lambda a, b: b - a, len),
+                         ['ccc', 'bb', 'a'])
+
 
 if __name__ == '__main__':
     unittest.main()